@@ -10,11 +10,13 @@ Notes
 - Handles high concurrency where multiple recipes modify the same repo simultaneously.
 """
 
+import os
 import plistlib
 import random
 import shlex
 import shutil
 import subprocess
+import tempfile
 import time
 from collections.abc import Iterable
 from pathlib import Path
@@ -83,6 +85,22 @@ class MunkiWorktreeCommitter(Processor):
             "required": False,
             "description": "The temp branch name (set by MunkiWorktreeCreator).",
         },
+        "temp_index_commit": {
+            "required": False,
+            "description": (
+                "Build the commit with git plumbing in a temporary index seeded from "
+                "<branch> as just fetched from <remote>, holding only the staged "
+                "paths, instead of git add and git commit in the worktree. Skips the "
+                "scan of the whole worktree and never writes the checkout's own "
+                "index, so it also works in a sparse worktree with nothing checked "
+                "out."
+            ),
+            "default": False,
+        },
+        "worktree_sparse": {
+            "required": False,
+            "description": "True if the worktree is a sparse checkout (set by MunkiWorktreeCreator).",
+        },
     }
     output_variables: dict[str, str] = {
         "munki_repo_commit_sha": "Commit SHA created (if any).",
@@ -115,15 +133,23 @@ class MunkiWorktreeCommitter(Processor):
         repo_changed = self._bool(self.env.get("munki_repo_changed"), True)
         return require_change and not repo_changed
 
-    def _run_cmd(self, args: list[str], cwd: Path) -> str:
+    def _run_cmd(
+        self,
+        args: list[str],
+        cwd: Path,
+        env: dict[str, str] | None = None,
+        stdin: str | None = None,
+    ) -> str:
         try:
             result = subprocess.run(
                 args,
                 cwd=str(cwd),
                 check=True,
+                input=stdin,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
                 text=True,
+                env={**os.environ, **env} if env else None,
             )
         except subprocess.CalledProcessError as error:
             quoted = " ".join(map(shlex.quote, args))
@@ -259,6 +285,126 @@ class MunkiWorktreeCommitter(Processor):
         status = self._run_cmd(["git", "status", "--porcelain"], cwd=repo_root)
         return bool(status.strip())
 
+    def _commit_in_worktree(
+        self, worktree_path: Path, rels: list[str], message: str
+    ) -> str | None:
+        """Stage and commit in the worktree. Returns the commit SHA, or None if nothing changed."""
+        add = ["git", "add", "-A"]
+        if self._bool(self.env.get("worktree_sparse")):
+            # Paths outside a sparse checkout (eg pkgs/) can only be staged with --sparse
+            add.append("--sparse")
+
+        if rels:
+            self._run_cmd([*add, "--", *rels], cwd=worktree_path)
+        else:
+            self._run_cmd(add, cwd=worktree_path)
+
+        if not self._git_has_changes(worktree_path):
+            return None
+
+        self._run_cmd(["git", "commit", "-m", message], cwd=worktree_path)
+        return self._run_cmd(["git", "rev-parse", "HEAD"], cwd=worktree_path)
+
+    def _temp_index_changes(
+        self, worktree_path: Path, paths: list[Path]
+    ) -> tuple[list[str], list[str]]:
+        """
+        Repo-relative (added_or_modified, deleted) files for paths, as git add
+        -A would stage them in the worktree: files are taken as given, and a
+        directory contributes what changed under it against the worktree's own
+        index, skipping ignored files and those a sparse checkout left out.
+        """
+        files, dirs = [], []
+        for path in paths:
+            try:
+                rel = str(path.resolve().relative_to(worktree_path.resolve()))
+            except ValueError as exc:
+                raise ProcessorError(
+                    f"{path} is outside the repo at {worktree_path}"
+                ) from exc
+            (dirs if path.is_dir() else files).append(rel)
+        if not dirs:
+            return files, []
+
+        def ls_files(*args: str) -> list[str]:
+            output = self._run_cmd(
+                ["git", "ls-files", "-z", *args, "--", *dirs],
+                cwd=worktree_path,
+                env={"GIT_LITERAL_PATHSPECS": "1"},
+            )
+            return [rel for rel in output.split("\0") if rel]
+
+        deleted = ls_files("--deleted")
+        # --modified lists deleted files too
+        changed = set(ls_files("--modified", "--others", "--exclude-standard"))
+        files.extend(sorted(changed.difference(deleted)))
+        return files, deleted
+
+    def _commit_with_temp_index(
+        self, worktree_path: Path, paths: list[Path], message: str
+    ) -> str | None:
+        """
+        Commit paths on top of <remote>/<branch> in a temporary index holding
+        the base tree plus just the changes to those paths, without touching
+        the worktree's checkout or index. Concurrent recipes touch different
+        files, so they can all do this at once.
+
+        The base is fetched first, so the commit sits on the current tip of the
+        branch rather than wherever the shared repo last fetched it.
+
+        Returns the commit SHA, or None if the paths match the base already.
+        """
+        remote = self.env.get("remote", "origin")
+        branch = self.env.get("branch", "main")
+        # An empty --refmap leaves refs/remotes alone: every worktree shares
+        # them, so concurrent fetches would contend for the ref lock. The tip
+        # only lands in this worktree's own FETCH_HEAD.
+        self._run_cmd(
+            ["git", "fetch", "--no-tags", "--refmap=", remote, branch],
+            cwd=worktree_path,
+        )
+        base = self._run_cmd(["git", "rev-parse", "FETCH_HEAD"], cwd=worktree_path)
+
+        added, deleted = self._temp_index_changes(worktree_path, paths)
+        if not added and not deleted:
+            return None
+
+        # Paths outside a sparse checkout (eg pkgs/) can only be staged with --sparse
+        sparse = ["--sparse"] if self._bool(self.env.get("worktree_sparse")) else []
+        base_tree = self._run_cmd(
+            ["git", "rev-parse", f"{base}^{{tree}}"], cwd=worktree_path
+        )
+        with tempfile.TemporaryDirectory(prefix="autopkg_index_") as temp_dir:
+            env = {
+                "GIT_INDEX_FILE": str(Path(temp_dir) / "index"),
+                "GIT_LITERAL_PATHSPECS": "1",
+            }
+            self._run_cmd(["git", "read-tree", base], cwd=worktree_path, env=env)
+            # git add refuses ignored paths, as it would in the worktree
+            for args, rels in (
+                (["add", *sparse], added),
+                (["rm", "--cached", "--quiet", "--ignore-unmatch", *sparse], deleted),
+            ):
+                if rels:
+                    self._run_cmd(
+                        [
+                            "git",
+                            *args,
+                            "--pathspec-from-file=-",
+                            "--pathspec-file-nul",
+                        ],
+                        cwd=worktree_path,
+                        env=env,
+                        stdin="\0".join(rels),
+                    )
+            tree = self._run_cmd(["git", "write-tree"], cwd=worktree_path, env=env)
+
+        if tree == base_tree:
+            return None
+        return self._run_cmd(
+            ["git", "commit-tree", tree, "-p", base, "-m", message], cwd=worktree_path
+        )
+
     def _commit_message(self, pkginfo_path: Path | None) -> str:
         name = None
         version = None
@@ -283,8 +429,10 @@ class MunkiWorktreeCommitter(Processor):
             .strip()
         )
 
-    def _push_worktree_branch(self, worktree_path: Path) -> None:
-        """Push the worktree branch to remote for auto-merge."""
+    def _push_worktree_branch(
+        self, worktree_path: Path, sha: str | None = None
+    ) -> None:
+        """Push the worktree branch (or sha, as that branch) to remote for auto-merge."""
         remote = self.env.get("remote", "origin")
         branch_name = self.env.get("worktree_branch")
         max_retries = 5
@@ -294,10 +442,12 @@ class MunkiWorktreeCommitter(Processor):
 
         for attempt in range(1, max_retries + 1):
             try:
-                self._run_cmd(
-                    ["git", "push", remote, f"{branch_name}:{branch_name}"],
-                    cwd=worktree_path,
+                refspec = (
+                    f"{sha}:refs/heads/{branch_name}"
+                    if sha
+                    else f"{branch_name}:{branch_name}"
                 )
+                self._run_cmd(["git", "push", remote, refspec], cwd=worktree_path)
 
                 self.output(f"Successfully pushed branch {branch_name} to {remote}")
                 return
@@ -361,23 +511,20 @@ class MunkiWorktreeCommitter(Processor):
             return
 
         paths = self._paths_to_stage(worktree_path)
+        rels = [str(path) for path in paths]
+        message = self._commit_message(self._pkginfo_path())
 
-        if paths:
-            rels = [str(path) for path in paths]
-            self._run_cmd(["git", "add", "-A", "--", *rels], cwd=worktree_path)
+        temp_index = self._bool(self.env.get("temp_index_commit"))
+        if temp_index:
+            sha = self._commit_with_temp_index(worktree_path, paths, message)
         else:
-            rels = []
-            self._run_cmd(["git", "add", "-A"], cwd=worktree_path)
+            sha = self._commit_in_worktree(worktree_path, rels, message)
 
-        if not self._git_has_changes(worktree_path):
+        if sha is None:
             self._record_skip("No changes to commit.")
             do_cleanup()
             return
 
-        message = self._commit_message(self._pkginfo_path())
-        self._run_cmd(["git", "commit", "-m", message], cwd=worktree_path)
-
-        sha = self._run_cmd(["git", "rev-parse", "HEAD"], cwd=worktree_path)
         self.env["munki_repo_commit_sha"] = sha
         self.env["munki_repo_commit_message"] = message
         self.env["munki_repo_commit_paths"] = rels
@@ -389,7 +536,8 @@ class MunkiWorktreeCommitter(Processor):
 
         if self._bool(self.env.get("push")):
             try:
-                self._push_worktree_branch(worktree_path)
+                # A temp index commit is on no local branch, so it is pushed by SHA
+                self._push_worktree_branch(worktree_path, sha if temp_index else None)
             except ProcessorError:
                 # Ensure cleanup happens even if push fails
                 do_cleanup()
@@ -11,6 +11,7 @@ This isolates file modifications and Git operations, allowing high concurrency.
 
 import shutil
 import subprocess
+import sys
 import tempfile
 import time
 from pathlib import Path
@@ -31,15 +32,35 @@ class MunkiWorktreeCreator(Processor):
         },
         "COPY_CATALOGS_TO_WORKTREE": {
             "required": False,
-            "description": "Copy catalogs to worktree. Useful when catalogs are not tracked by git.",
+            "description": (
+                "Copy catalogs to worktree. Useful when catalogs are not tracked by git. "
+                "Copied as copy-on-write clones where the filesystem supports them."
+            ),
             "default": False,
         },
+        "SPARSE_WORKTREE": {
+            "required": False,
+            "description": (
+                "Check out only SPARSE_WORKTREE_PATHS (and files at the repo root) "
+                "in the worktree, instead of the whole repo."
+            ),
+            "default": False,
+        },
+        "SPARSE_WORKTREE_PATHS": {
+            "required": False,
+            "description": (
+                "Directories checked out by SPARSE_WORKTREE. Add catalogs if they "
+                "are tracked by git rather than copied."
+            ),
+            "default": ["pkgsinfo", "icons"],
+        },
     }
     output_variables: dict[str, str] = {
         "repo_path": "Overwritten to point to the temporary worktree.",
         "MUNKI_REPO": "Overwritten to point to the temporary worktree.",
         "original_munki_repo": "The path to the main repo (for cleanup later).",
         "worktree_branch": "The specific branch name created for this worktree.",
+        "worktree_sparse": "True if the worktree is a sparse checkout.",
     }
 
     def _bool(self, val: Any, default: bool = False) -> bool:
@@ -54,6 +75,46 @@ class MunkiWorktreeCreator(Processor):
             return False
         return default
 
+    def _sparse_checkout(self, worktree: Path) -> None:
+        """Populate a --no-checkout worktree with just SPARSE_WORKTREE_PATHS."""
+        paths = self.env["SPARSE_WORKTREE_PATHS"]
+        if isinstance(paths, str):
+            paths = [path.strip() for path in paths.split(",") if path.strip()]
+
+        for cmd in (
+            ["git", "sparse-checkout", "set", "--cone", *paths],
+            ["git", "checkout"],
+        ):
+            subprocess.run(
+                cmd, cwd=str(worktree), check=True, capture_output=True, text=True
+            )
+
+    def _clone_tree(self, source: Path, destination: Path) -> None:
+        """
+        Copy a directory as copy-on-write clones (APFS, Btrfs, XFS), which
+        share their data with the original until one is modified, falling
+        back to a plain copy. Hard links would be cheaper still, but would
+        let MunkiImporter's writes leak back into the main repo.
+        """
+        if sys.platform == "darwin":
+            attempts = [["cp", "-c", "-R"], ["cp", "-R"]]
+        else:
+            attempts = [["cp", "-R", "--reflink=auto"]]
+
+        for attempt, cmd in enumerate(attempts, 1):
+            try:
+                subprocess.run(
+                    [*cmd, str(source), str(destination)],
+                    check=True,
+                    capture_output=True,
+                    text=True,
+                )
+                return
+            except subprocess.CalledProcessError:
+                if attempt == len(attempts):
+                    raise
+                shutil.rmtree(destination, ignore_errors=True)
+
     def main(self) -> None:
         self.env = getattr(self, "env", {})
 
@@ -61,6 +122,7 @@ class MunkiWorktreeCreator(Processor):
         recipe_name = self.env["NAME"]
         base_branch = self.env["GIT_DEFAULT_BRANCH"]
         should_copy_catalogs = self._bool(self.env["COPY_CATALOGS_TO_WORKTREE"])
+        sparse = self._bool(self.env["SPARSE_WORKTREE"])
 
         # Sanity check the main repo
         if not (main_repo / ".git").exists():
@@ -74,11 +136,13 @@ class MunkiWorktreeCreator(Processor):
         temp_dir = Path(tempfile.mkdtemp(prefix="autopkg_worktree_"))
 
         # Create Worktree
-        # git worktree add -b <new_branch> <path> <origin/base>
+        # git worktree add [--no-checkout] -b <new_branch> <path> <origin/base>
+        # A sparse worktree is checked out afterwards, once told which paths it needs
         cmd = [
             "git",
             "worktree",
             "add",
+            *(["--no-checkout"] if sparse else []),
             "-b",
             branch_name,
             str(temp_dir),
@@ -91,12 +155,15 @@ class MunkiWorktreeCreator(Processor):
             subprocess.run(
                 cmd, cwd=str(main_repo), check=True, capture_output=True, text=True
             )
+            if sparse:
+                self._sparse_checkout(temp_dir)
 
             # This forces MunkiImporter (and other subsequent steps) to use the worktree
             self.env["original_munki_repo"] = str(main_repo)
             self.env["repo_path"] = str(temp_dir)
             self.env["MUNKI_REPO"] = str(temp_dir)
             self.env["worktree_branch"] = branch_name
+            self.env["worktree_sparse"] = sparse
 
             self.output(
                 (
@@ -108,13 +175,15 @@ class MunkiWorktreeCreator(Processor):
         except subprocess.CalledProcessError as exc:
             # Cleanup temp dir if git fails
             shutil.rmtree(temp_dir, ignore_errors=True)
+            subprocess.run(
+                ["git", "worktree", "prune"], cwd=str(main_repo), capture_output=True
+            )
             raise ProcessorError(f"Failed to create worktree: {exc.stderr}") from exc
 
         if should_copy_catalogs:
             self.output("Copying catalogs to worktree")
             try:
-                cmd = ["cp", "-R", main_repo / "catalogs", temp_dir / "catalogs"]
-                subprocess.run(cmd, check=True, capture_output=True, text=True)
+                self._clone_tree(main_repo / "catalogs", temp_dir / "catalogs")
 
                 self.output("Successfully copied catalogs to worktree", verbose_level=0)
             except subprocess.CalledProcessError as exc:
@@ -1,7 +1,9 @@
 import enum
 import os
 import sys
+import tarfile
 import tempfile
+import time
 from collections import OrderedDict
 from datetime import datetime, timezone
 from plistlib import dumps as plist_dumps
@@ -23,6 +25,11 @@ __all__ = ["AutopkgVendorer"]
 class AutopkgVendorer(Processor):
     description = __doc__
 
+    TEXT_EXTENSIONS = (".md", ".py", ".yaml", ".recipe")
+    DEFAULT_TARBALL_CACHE_DIR = "~/Library/AutoPkg/Cache/AutopkgVendorer"
+    DEFAULT_TARBALL_CACHE_MAX_MB = 2048
+    DEFAULT_TARBALL_CACHE_MAX_AGE_DAYS = 30
+
     input_variables = {
         "github_repo": {"required": True, "description": "GitHub repository (owner/repo)"},
         "folder_path": {"required": True, "description": "Folder or file inside repo to download"},
@@ -36,6 +43,23 @@ class AutopkgVendorer(Processor):
             "required": False,
             "description": "Use opinionated ordering for recipe keys (default True)",
         },
+        "bulk_download": {
+            "required": False,
+            "description": "Fetch one tarball per repo/commit instead of one request per file (default True)",
+        },
+        "tarball_cache_dir": {
+            "required": False,
+            "description": "Directory for cached repo tarballs shared between recipes "
+            "(default ~/Library/AutoPkg/Cache/AutopkgVendorer)",
+        },
+        "tarball_cache_max_mb": {
+            "required": False,
+            "description": "Evict the least recently used tarballs once the cache exceeds this size (default 2048)",
+        },
+        "tarball_cache_max_age_days": {
+            "required": False,
+            "description": "Evict tarballs not used for this many days (default 30)",
+        },
     }
 
     output_variables = {
@@ -113,15 +137,18 @@ class AutopkgVendorer(Processor):
         dest_path: str,
         convert_to_yaml: bool = False,
         opinionated_ordering: bool = True,
+        file_contents: str | None = None,
     ):
         # Only process text-based files
-        text_extensions = (".md", ".py", ".yaml", ".recipe")
-        if not item_name.endswith(text_extensions):
+        if not item_name.endswith(self.TEXT_EXTENSIONS):
             self.output(f"Skipping non-text file: {item_path}")
             return
 
-        file_contents = self.download_text_file(session, repo, item_path, commit_sha)
-        self.output(f"Downloaded: {item_path} → {dest_path}")
+        if file_contents is None:
+            file_contents = self.download_text_file(session, repo, item_path, commit_sha)
+            self.output(f"Downloaded: {item_path} → {dest_path}")
+        else:
+            self.output(f"Extracted: {item_path} → {dest_path}")
 
         if item_name.endswith(".recipe"):
             plist_data = plist_loads(file_contents.encode("utf-8"))
@@ -205,6 +232,121 @@ class AutopkgVendorer(Processor):
 
         return vendorer_paths
 
+    def fetch_tarball(self, session, repo: str, commit_sha: str) -> str:
+        """Return a local path to the tarball of repo at commit_sha, downloading it
+        once into the shared cache. Commits are immutable, so cached copies never go stale."""
+        cache_dir = os.path.expanduser(self.env.get("tarball_cache_dir") or self.DEFAULT_TARBALL_CACHE_DIR)
+        tarball = os.path.join(cache_dir, f"{repo.replace('/', '--')}-{commit_sha}.tar.gz")
+        if os.path.exists(tarball):
+            try:
+                os.utime(tarball)  # bump mtime so eviction is least-recently-used
+            except OSError:
+                pass
+            self.output(f"Using cached tarball: {tarball}")
+            return tarball
+
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=cache_dir, prefix=".download-")
+        os.close(fd)
+        url = f"https://codeload.github.com/{repo}/tar.gz/{commit_sha}"
+        curl_cmd = ["/usr/bin/curl", "--location", "--silent", "--fail", "--output", temp_file, url]
+        try:
+            session.download_with_curl(curl_cmd)
+            # Atomic rename so concurrent recipes never read a partial tarball
+            os.replace(temp_file, tarball)
+        except Exception as e:
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+            raise ProcessorError(f"Failed to download tarball for {repo} at {commit_sha}: {e}")
+        self.output(f"Downloaded tarball: {url}")
+        self.prune_tarball_cache(cache_dir, keep=tarball)
+        return tarball
+
+    def prune_tarball_cache(self, cache_dir: str, keep: str) -> None:
+        """Evict tarballs unused for longer than the max age, then the least recently
+        used until the cache fits the max size. Each new commit of a repo adds a
+        tarball, so without this the cache only grows. keep is never evicted."""
+        max_bytes = float(self.env.get("tarball_cache_max_mb") or self.DEFAULT_TARBALL_CACHE_MAX_MB) * 1024 * 1024
+        max_age = float(self.env.get("tarball_cache_max_age_days") or self.DEFAULT_TARBALL_CACHE_MAX_AGE_DAYS) * 86400
+        now = time.time()
+        entries = []
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            # Dotfiles are downloads still in progress
+            if name.startswith(".") or path == keep:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+
+        total = os.path.getsize(keep) + sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries):
+            if now - mtime <= max_age and total <= max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.output(f"Evicted cached tarball: {path}")
+
+    def vendor_tarball(
+        self,
+        session,
+        repo: str,
+        path: str,
+        commit_sha: str,
+        dest_base,
+        convert_to_yaml=False,
+        opinionated_ordering=True,
+    ):
+        """Vendor `path` out of the repo tarball, streaming only the members under it
+        through the same convert/reorder/header pipeline as process_file."""
+        tarball = self.fetch_tarball(session, repo, commit_sha)
+        path = path.strip("/")
+        vendorer_paths = []
+
+        with tarfile.open(tarball, mode="r|gz") as tar:
+            for member in tar:
+                # Members are prefixed with "<owner>-<repo>-<shortsha>/"
+                item_path = member.name.split("/", 1)[1] if "/" in member.name else ""
+                if item_path == path:
+                    rel_path = os.path.basename(item_path)
+                elif item_path.startswith(f"{path}/"):
+                    rel_path = item_path[len(path) + 1 :]
+                else:
+                    continue
+
+                if member.isdir():
+                    continue
+                if not member.isfile():
+                    self.output(f"Skipping unknown type at {item_path}")
+                    continue
+
+                item_name = os.path.basename(item_path)
+                dest_path = os.path.join(dest_base, rel_path)
+                file_contents = None
+                if item_name.endswith(self.TEXT_EXTENSIONS):
+                    file_contents = tar.extractfile(member).read().decode("utf-8")
+                self.process_file(
+                    session,
+                    repo,
+                    item_path,
+                    item_name,
+                    commit_sha,
+                    dest_path,
+                    convert_to_yaml,
+                    opinionated_ordering=opinionated_ordering,
+                    file_contents=file_contents,
+                )
+                vendorer_paths.append(dest_path)
+
+        if not vendorer_paths:
+            raise ProcessorError(f"Path {path} not found in {repo} at {commit_sha}")
+        return vendorer_paths
+
     def main(self):
         repo = self.env["github_repo"]
         folder_path = self.env["folder_path"]
@@ -214,6 +356,7 @@ class AutopkgVendorer(Processor):
         convert_to_yaml = self.env.get("convert_to_yaml", True)
         required_license = self.env.get("required_license", None)
         opinionated_ordering = self.env.get("opinionated_ordering", True)
+        bulk_download = self.env.get("bulk_download", True)
 
         os.makedirs(destination_path, exist_ok=True)
         gh_session = GitHubSession(github_token)
@@ -225,15 +368,31 @@ class AutopkgVendorer(Processor):
                     f"Input variable license_type ({required_license}) does not match the found license ({found_license})."
                 )
 
-        vendored_paths = self.vendor_path(
-            session=gh_session,
-            repo=repo,
-            path=folder_path,
-            commit_sha=commit_sha,
-            dest_base=destination_path,
-            convert_to_yaml=convert_to_yaml,
-            opinionated_ordering=opinionated_ordering,
-        )
+        vendored_paths = None
+        if bulk_download:
+            try:
+                vendored_paths = self.vendor_tarball(
+                    session=gh_session,
+                    repo=repo,
+                    path=folder_path,
+                    commit_sha=commit_sha,
+                    dest_base=destination_path,
+                    convert_to_yaml=convert_to_yaml,
+                    opinionated_ordering=opinionated_ordering,
+                )
+            except (ProcessorError, tarfile.TarError) as e:
+                self.output(f"Bulk download failed, falling back to per-file download: {e}")
+
+        if vendored_paths is None:
+            vendored_paths = self.vendor_path(
+                session=gh_session,
+                repo=repo,
+                path=folder_path,
+                commit_sha=commit_sha,
+                dest_base=destination_path,
+                convert_to_yaml=convert_to_yaml,
+                opinionated_ordering=opinionated_ordering,
+            )
 
         self.env["downloaded_folder_path"] = destination_path
         self.output(f"Downloaded folder available at: {destination_path}")
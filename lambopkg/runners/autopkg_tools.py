@@ -1,9 +1,14 @@
 import asyncio
+import itertools
 import json
 import logging
 import os
-from contextlib import contextmanager
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone
+from functools import partial
 from pathlib import Path
 
 from cloud_autopkg_runner import (
@@ -16,27 +21,237 @@ from cloud_autopkg_runner import (
 from git import Repo
 from github import Auth, Github
 
+DEFAULT_CONCURRENCY = 8
+DEFAULT_GIT_CONCURRENCY = 4
+BASE_REF = "origin/main"
 
-@contextmanager
-def worktree(repo: Repo, path: Path, branch: str):
-    """Create git worktree for isolated recipe processing."""
-    repo.create_head(branch)
-    repo.git.worktree("add", str(path), branch)
+
+class AdaptiveLimiter:
+    """Caps how many tasks run a phase at once, adapting the cap to how the phase copes.
+
+    The limit starts at half of max_limit and grows by one for every `limit`
+    tasks that complete in time (additive increase), up to max_limit. It is
+    halved (multiplicative decrease, down to 1) when errors become frequent
+    or the recent latency of the phase rises above latency_factor times its
+    long-run average, i.e. when more concurrency stops buying throughput.
+    Only tasks started since the last decrease can trigger the next one, so
+    a burst of failures from one overloaded moment backs off once.
+    """
+
+    def __init__(self, name: str, max_limit: int, latency_factor: float = 2.0, error_threshold: float = 0.2):
+        self.name = name
+        self.max_limit = max(1, max_limit)
+        self.limit = max(1, self.max_limit // 2)
+        self.latency_factor = latency_factor
+        self.error_threshold = error_threshold
+        self.in_flight = 0
+        self._successes = 0
+        self._generation = 0
+        self._short_latency: float | None = None
+        self._long_latency: float | None = None
+        self._error_rate = 0.0
+        self._cond = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Wait for a free slot, and hold it for the body of the `async with`."""
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+            generation = self._generation
+        start = time.monotonic()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            async with self._cond:
+                self.in_flight -= 1
+                self._record(ok, time.monotonic() - start, generation)
+                self._cond.notify_all()
+
+    def _record(self, ok: bool, latency: float, generation: int) -> None:
+        self._error_rate += 0.1 * ((not ok) - self._error_rate)
+        if not ok:
+            if self._error_rate > self.error_threshold:
+                self._back_off(generation, f"error rate {self._error_rate:.0%}")
+            return
+
+        # Short- and long-run moving averages of how long the phase takes
+        if self._short_latency is None:
+            self._short_latency = self._long_latency = latency
+        self._short_latency += 0.3 * (latency - self._short_latency)
+        self._long_latency += 0.05 * (latency - self._long_latency)
+        if self._short_latency > self.latency_factor * self._long_latency:
+            self._back_off(generation, f"latency {self._short_latency:.1f}s vs {self._long_latency:.1f}s usual")
+            return
+
+        self._successes += 1
+        if self._successes >= self.limit and self.limit < self.max_limit:
+            self._successes = 0
+            self.limit += 1
+            logging.getLogger(__name__).debug("%s concurrency up to %d", self.name, self.limit)
+
+    def _back_off(self, generation: int, reason: str) -> None:
+        if generation != self._generation:
+            return
+        self._generation += 1
+        self._successes = 0
+        self.limit = max(1, self.limit // 2)
+        logging.getLogger(__name__).info("%s concurrency down to %d (%s)", self.name, self.limit, reason)
+
+
+class Limits:
+    """Concurrency caps for recipe processing, read from the environment.
+
+    LAMBOPKG_CONCURRENCY bounds how many recipes are in progress at once.
+    Within that, LAMBOPKG_DOWNLOAD_CONCURRENCY and LAMBOPKG_GIT_CONCURRENCY
+    cap the autopkg run (downloads, packaging) and the git work (worktrees,
+    commits, pushes) of those recipes, each adapting below its cap.
+
+    Blocking GitPython and PyGithub calls run in a thread pool (see run), so
+    they overlap with each other and with recipe runs. Only the steps that
+    update a repository's shared worktree and branch metadata are serialised,
+    by a lock per repository.
+    """
+
+    def __init__(self):
+        total = int(os.environ.get("LAMBOPKG_CONCURRENCY", DEFAULT_CONCURRENCY))
+        self.recipes = asyncio.Semaphore(max(1, total))
+        self.download = AdaptiveLimiter(
+            "download", min(total, int(os.environ.get("LAMBOPKG_DOWNLOAD_CONCURRENCY", total)))
+        )
+        self.git = AdaptiveLimiter(
+            "git", min(total, int(os.environ.get("LAMBOPKG_GIT_CONCURRENCY", DEFAULT_GIT_CONCURRENCY)))
+        )
+        # A recipe in progress waits on at most one blocking call at a time
+        self.executor = ThreadPoolExecutor(max_workers=max(1, total), thread_name_prefix="autopkg-git")
+        self.repo_locks: dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+    async def run(self, func, *args):
+        """Run the blocking func(*args) in the thread pool, without blocking the event loop."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, partial(func, *args))
+
+
+def add_worktree(repo: Repo, path: Path) -> Repo:
+    repo.git.worktree("add", "--detach", str(path), BASE_REF)
+    return Repo(path)
+
+
+def reset_worktree(wt_repo: Repo, branch: str) -> None:
+    """Switch a worktree to a new branch at BASE_REF, discarding whatever the last recipe left in it."""
+    # --no-track: recording the upstream writes the config shared by all worktrees, which fails when two switch at once
+    wt_repo.git.checkout("--force", "--no-track", "-B", branch, BASE_REF)
+    wt_repo.git.clean("-ffdx")
+
+
+def remove_worktree(repo: Repo, path: Path) -> None:
+    repo.git.worktree("remove", str(path), "--force")
+    repo.git.worktree("prune")
+
+
+class WorktreePool:
+    """Worktrees of a repository, reused across recipes instead of checked out afresh for each.
+
+    A recipe borrows a worktree (see checkout) switched to its own branch at
+    BASE_REF, and gives it back when done. New worktrees are only added when
+    none is idle, so there are never more than recipes run at once. Switching
+    an existing checkout rewrites just the files the last recipe changed, so
+    setup costs about the same however large the repo is.
+    """
+
+    def __init__(self, repo: Repo, limits: Limits):
+        self.repo = repo
+        self.limits = limits
+        self.idle: list[Repo] = []
+        self.worktrees: dict[str, Repo] = {}  # every worktree added and not yet removed, by path
+        self._ids = itertools.count()
+        self._stamp = f"{datetime.now(timezone.utc):%Y%m%d%H%M%S}"
+
+    @asynccontextmanager
+    async def checkout(self, branch: str):
+        """Lend a worktree on a new branch at BASE_REF for the body of the `async with`."""
+        wt_repo = self.idle.pop() if self.idle else None
+        try:
+            async with self.limits.git.slot():
+                if wt_repo is None:
+                    wt_repo = await self._add()
+                await self.limits.run(reset_worktree, wt_repo, branch)
+        except Exception:
+            # A worktree that can't be reset is not reused
+            if wt_repo is not None:
+                await self._remove(wt_repo)
+            raise
+        try:
+            yield wt_repo
+        finally:
+            self.idle.append(wt_repo)
+
+    async def close(self) -> None:
+        """Remove every worktree of the pool. Call once no recipe is borrowing one."""
+        self.idle.clear()
+        for wt_repo in list(self.worktrees.values()):
+            try:
+                await self._remove(wt_repo)
+            except Exception:
+                logging.getLogger(__name__).exception("Failed to remove worktree %s", wt_repo.working_tree_dir)
+
+    async def _add(self) -> Repo:
+        path = Path(self.repo.working_tree_dir).parent / f"worktree-{self._stamp}-{next(self._ids)}"
+        # Worktrees are recorded in the shared repo, so only one recipe at a time adds or removes them
+        async with self.limits.repo_locks[self.repo.git_dir]:
+            wt_repo = await self.limits.run(add_worktree, self.repo, path)
+        self.worktrees[wt_repo.working_tree_dir] = wt_repo
+        return wt_repo
+
+    async def _remove(self, wt_repo: Repo) -> None:
+        async with self.limits.repo_locks[self.repo.git_dir]:
+            await self.limits.run(remove_worktree, self.repo, Path(wt_repo.working_tree_dir))
+        self.worktrees.pop(wt_repo.working_tree_dir, None)
+
+
+def commit_items(wt_repo: Repo, munki_repo_path: str, items: list[dict], message: str) -> None:
+    """Stage the pkginfos and icons of imported items in a worktree, and commit them."""
+    # Stage metadata files for git (packages are gitignored, synced to S3 separately)
+    for item in items:
+        files = [f"{munki_repo_path}/pkgsinfo/{item.get('pkginfo_path')}"]
+        if item.get("icon_repo_path"):
+            files.append(f"{munki_repo_path}/icons/{item.get('icon_repo_path')}")
+        wt_repo.index.add(files)
+
+    # Catch any untracked icons (some recipes produce icons without setting icon_repo_path)
+    icons_dir = f"{munki_repo_path}/icons"
+    if os.path.isdir(icons_dir):
+        wt_repo.index.add([icons_dir])
+
+    # Not index.commit: it writes COMMIT_EDITMSG in the repo shared by all worktrees, so concurrent commits collide
+    wt_repo.git.commit("--allow-empty", "-m", message)
+
+
+def create_pull(token: str, gh_repo: str, branch: str, name: str, version: str) -> str:
+    """Open a PR for branch via PyGithub, returning its URL."""
+    gh = Github(auth=Auth.Token(token))
     try:
-        yield Repo(path)
+        pr = gh.get_repo(gh_repo).create_pull(
+            title=f"AutoPkg: {name} {version}",
+            body=f"Automated update for `{name}` version `{version}`.",
+            head=branch,
+            base="main",
+        )
+        return pr.html_url
     finally:
-        repo.git.worktree("remove", str(path), "--force")
-        repo.git.worktree("prune")
+        gh.close()
 
 
 async def process_recipe(
     recipe_path: Path,
-    git_repo_root: Path,
+    worktrees: WorktreePool,
     munki_subdir: str,
     gh_repo: str,
     token: str,
     settings: Settings,
     autopkg_prefs: AutoPkgPrefs,
+    limits: Limits,
 ) -> None:
     """Run recipe in isolated worktree, commit, push, create PR."""
     logger = logging_config.get_logger(__name__)
@@ -46,19 +261,17 @@ async def process_recipe(
 
     now = datetime.now(timezone.utc)
     branch = f"autopkg-{recipe_name.replace(' ', '-')}-{now:%Y%m%d%H%M%S}"
-    worktree_path = git_repo_root.parent / f"worktree-{recipe_name}-{now:%Y%m%d%H%M%S}"
 
-    # Clone prefs and point at worktree's munki subdir
-    prefs = autopkg_prefs.clone()
-    prefs.munki_repo = worktree_path / munki_subdir
+    async with worktrees.checkout(branch) as wt_repo:
+        # Clone prefs and point at worktree's munki subdir
+        prefs = autopkg_prefs.clone()
+        prefs.munki_repo = Path(wt_repo.working_tree_dir) / munki_subdir
 
-    base_repo = Repo(git_repo_root)
-
-    with worktree(base_repo, worktree_path, branch) as wt_repo:
         # Run recipe with prefs pointing to worktree
         with prefs:
             try:
-                results = await Recipe(recipe_path, settings.report_dir, prefs).run()
+                async with limits.download.slot():
+                    results = await Recipe(recipe_path, settings.report_dir, prefs).run()
                 logger.debug("AutoPkg recipe run results: %s", results)
                 logger.info("Recipe run %s complete", recipe_name)
             except Exception:
@@ -69,38 +282,20 @@ async def process_recipe(
             logger.info("No changes for %s", recipe_name)
             return
 
-        # Stage metadata files for git (packages are gitignored, synced to S3 separately)
-        munki_repo_path = str(prefs.munki_repo)
-        for item in results["munki_imported_items"]:
-            files = [f"{munki_repo_path}/pkgsinfo/{item.get('pkginfo_path')}"]
-            if item.get("icon_repo_path"):
-                files.append(f"{munki_repo_path}/icons/{item.get('icon_repo_path')}")
-            wt_repo.index.add(files)
-
-        # Catch any untracked icons (some recipes produce icons without setting icon_repo_path)
-        icons_dir = f"{munki_repo_path}/icons"
-        if os.path.isdir(icons_dir):
-            wt_repo.index.add([icons_dir])
-
         # Commit and push
         name = results["munki_imported_items"][0]["name"]
         version = results["munki_imported_items"][0]["version"]
         commit_msg = f"AutoPkg {name} {version}"
 
-        wt_repo.index.commit(commit_msg)
-        wt_repo.remote("origin").push(refspec=f"{branch}:{branch}")
+        # Each worktree has its own index, so commits and pushes of different recipes overlap
+        async with limits.git.slot():
+            await limits.run(commit_items, wt_repo, str(prefs.munki_repo), results["munki_imported_items"], commit_msg)
+            await limits.run(partial(wt_repo.remote("origin").push, refspec=f"{branch}:{branch}"))
         logger.info("Pushed branch %s", branch)
 
         # Create PR via PyGithub
-        gh = Github(auth=Auth.Token(token))
-        pr = gh.get_repo(gh_repo).create_pull(
-            title=f"AutoPkg: {name} {version}",
-            body=f"Automated update for `{name}` version `{version}`.",
-            head=branch,
-            base="main",
-        )
-        logger.info("Created PR: %s", pr.html_url)
-        gh.close()
+        pr_url = await limits.run(create_pull, token, gh_repo, branch, name, version)
+        logger.info("Created PR: %s", pr_url)
 
 
 async def main() -> None:
@@ -136,21 +331,35 @@ async def main() -> None:
 
     logger.info("Found %d recipes to process", len(recipe_paths))
 
-    # Process all recipes in parallel - each gets its own worktree
-    await asyncio.gather(
-        *(
-            process_recipe(
+    # Process recipes in parallel, within the limits - each borrows a worktree from the pool
+    limits = Limits()
+    repo = await limits.run(Repo, munki_git_dir)
+    # Every recipe branch starts at BASE_REF, so bring it up to date once, before any worktree is switched to it
+    await limits.run(repo.git.fetch, *BASE_REF.split("/", 1))
+    worktrees = WorktreePool(repo, limits)
+
+    async def bounded(recipe: Path) -> None:
+        async with limits.recipes:
+            await process_recipe(
                 recipe_path=recipe,
-                git_repo_root=munki_git_dir,
+                worktrees=worktrees,
                 munki_subdir=munki_subdir,
                 gh_repo=munki_gh_repo,
                 token=github_token,
                 settings=settings,
                 autopkg_prefs=autopkg_prefs,
+                limits=limits,
             )
-            for recipe in recipe_paths
-        )
-    )
+
+    try:
+        # Wait for every recipe, even after one fails, so none still holds a worktree when the pool is closed
+        results = await asyncio.gather(*(bounded(recipe) for recipe in recipe_paths), return_exceptions=True)
+    finally:
+        await worktrees.close()
+        limits.executor.shutdown()
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
 
 
 if __name__ == "__main__":
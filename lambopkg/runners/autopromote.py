@@ -3,17 +3,40 @@
 # Copyright 2019 ZenPayroll, Inc., dba Gusto
 #
 
+import argparse
+import base64
+import copy
+import ctypes
+import ctypes.util
+import fcntl
+import hashlib
+import heapq
+import io
 import json
 import logging
 import os
+import pickle
 import plistlib
 import re
+import select
+import struct
 import subprocess
 import sys
-from collections import OrderedDict
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import cached_property, partial
 from logging import StreamHandler
 from logging.handlers import RotatingFileHandler
+from math import ceil, inf, isnan, nan
 from ssl import PROTOCOL_TLS_CLIENT, SSLContext
+from urllib.parse import urlparse
+from xml.etree import ElementTree
 from xml.parsers.expat import ExpatError
 
 import arrow
@@ -23,10 +46,19 @@ from packaging import version as semantic_version
 from slack_sdk import WebClient
 from slack_sdk.errors import SlackApiError
 
+try:
+    import boto3
+    from botocore.exceptions import ClientError
+except ImportError:
+    boto3 = ClientError = None
+
 CONFIG_FILE = os.getenv("CONFIG_FILE", "/usr/local/munki/autopromote.json")
-PKGINFOS_PATHS = []
 DEBUG = bool(os.environ.get("DEBUG"))
 SECONDS_IN_DAY = 60 * 60 * 24
+PARSE_CACHE_VERSION = 2
+DUE_INDEX_VERSION = 1
+# Below this many uncached pkginfos, spinning up worker processes costs more than it saves
+PARALLEL_PARSE_MIN = 256
 
 
 # Because things get easier if the catalogs are ordered - we don't always need to check "next"
@@ -84,12 +116,20 @@ def load_deny_and_allow_lists(config):
     return config
 
 
-def load_config():
-    """Reads autopromote.json from hardcoded path CONFIG_FILE"""
+def load_config(config_file=None):
+    """Reads autopromote.json from config_file, by default CONFIG_FILE"""
 
-    with open(CONFIG_FILE) as f:
+    with open(config_file or CONFIG_FILE) as f:
         config = json.load(f)
 
+    return prepare_config(config)
+
+
+def prepare_config(config):
+    """Orders the catalog schedule and compiles the allow and deny lists of a parsed autopromote.json"""
+
+    # Lets state saved between runs (eg the due index) tell which config it was computed under
+    config["_digest"] = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
     config["catalogs"], config["catalog_order"] = order_catalogs(config["catalogs"])
     config = load_deny_and_allow_lists(config)
     return config
@@ -100,6 +140,11 @@ def load_logger(logfile):
 
     logger = logging.getLogger("autopromote")
     level = logging.DEBUG if DEBUG else logging.INFO
+    logger.setLevel(level)
+
+    # Several AutoPromoters may share a logfile; give each logfile one handler
+    if any(getattr(h, "autopromote_logfile", None) == logfile for h in logger.handlers):
+        return logger
 
     formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
@@ -108,15 +153,14 @@ def load_logger(logfile):
     else:
         handler = RotatingFileHandler(logfile, maxBytes=1000000, backupCount=10)
 
+    handler.autopromote_logfile = logfile
     handler.setFormatter(formatter)
     logger.addHandler(handler)
-    logger.setLevel(level)
     return logger
 
 
-CONFIG = load_config()
-logger = load_logger(CONFIG.get("logfile", "stdout"))
-load_dotenv(dotenv_path=CONFIG.get("envfile", ".autopromote.env"))
+# Configured with handlers by AutoPromoter.logger; the module-level helpers log here too
+logger = logging.getLogger("autopromote")
 
 
 def get_pkgs(root):
@@ -135,12 +179,15 @@ def pkg_version(plist):
     return semantic_version.parse(plist["version"])
 
 
-def safe_read_pkg(pkginfo):
-    """Returns the contents of a pkginfo plist, or, if a parsing error occurs, None"""
+def safe_read_pkg(pkginfo, data=None):
+    """
+    Returns the contents of a pkginfo plist, or, if a parsing error occurs,
+    None. data is the pkginfo's contents if already fetched (eg from S3).
+    """
 
-    logger.info(f"parsing {pkginfo}")
+    logger.debug(f"parsing {pkginfo}")
     try:
-        with open(pkginfo, "rb") as f:
+        with open(pkginfo, "rb") if data is None else io.BytesIO(data) as f:
             plist = plistlib.load(f)
     except (ExpatError, plistlib.InvalidFileException) as e:
         # This is raised if a plist cannot be parsed (generally because its not a plist, but some clutter eg DS_Store)
@@ -152,332 +199,2025 @@ def safe_read_pkg(pkginfo):
     return plist
 
 
-def get_force_install_time(plist):
-    """Returns a force install datetime shifted to match the configured force_install_time"""
+# pkginfo key -> PkgRecord slot
+PKG_RECORD_SLOTS = {
+    "name": "name",
+    "version": "version",
+    "catalogs": "catalogs",
+    "_metadata": "metadata",
+    "force_install_after_date": "force_install_after_date",
+}
 
-    f = arrow.get(plist["force_install_after_date"])
-    r = f.shift(
-        hours=(int(CONFIG["force_install_time"]["hour"] or 0) - f.hour),
-        minutes=(int(CONFIG["force_install_time"]["minute"] or 0) - f.minute),
-    )
 
-    patch_day = CONFIG.get("patch_tuesday")
-    if isinstance(patch_day, int) and patch_day <= 6 and patch_day >= 0:
-        r = r.shift(weekday=patch_day)
+class PkgRecord:
+    """
+    The keys of a pkginfo that promotion reads, see AutoPromoter.record_keys.
+    Reads and writes like the plist dict it stands in for, so the parse cache
+    and the evaluator hold these instead of whole pkginfos (whose installs,
+    receipts and items_to_copy arrays can be large). A key the pkginfo
+    doesn't have is an unset slot; fields_to_copy keys are kept in extra.
+    """
+
+    __slots__ = ("catalogs", "extra", "force_install_after_date", "metadata", "name", "version")
+
+    def __init__(self, values=()):
+        self.extra = {}
+        for key, value in dict(values).items():
+            self[key] = value
+
+    @classmethod
+    def from_plist(cls, plist, keys):
+        return cls({key: plist[key] for key in keys if key in plist})
+
+    def __getitem__(self, key):
+        slot = PKG_RECORD_SLOTS.get(key)
+        if slot is None:
+            return self.extra[key]
+        try:
+            return getattr(self, slot)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        slot = PKG_RECORD_SLOTS.get(key)
+        if slot is None:
+            self.extra[key] = value
+        else:
+            setattr(self, slot, value)
+
+    def __contains__(self, key):
+        return key in self.extra if key not in PKG_RECORD_SLOTS else hasattr(self, PKG_RECORD_SLOTS[key])
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (PkgRecord, dict)):
+            return dict(self.items()) == dict(other.items())
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"PkgRecord({dict(self.items())!r})"
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [key for key in PKG_RECORD_SLOTS if key in self] + list(self.extra)
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def copy(self):
+        return PkgRecord(self.items())
+
+
+def plist_value(element):
+    """Returns the value of an XML plist element as plistlib.load would"""
+
+    tag = element.tag
+    if tag == "string":
+        return element.text or ""
+    if tag == "integer":
+        text = element.text.strip()
+        return int(text, 16) if text.startswith(("0x", "0X")) else int(text)
+    if tag == "real":
+        return float(element.text)
+    if tag in ("true", "false"):
+        return tag == "true"
+    if tag == "date":
+        return datetime.strptime(element.text, "%Y-%m-%dT%H:%M:%SZ")  # plistlib dates are naive UTC too
+    if tag == "data":
+        return base64.b64decode(element.text or "")
+    if tag == "array":
+        return [plist_value(child) for child in element]
+    if tag == "dict":
+        children = list(element)
+        return {k.text or "": plist_value(v) for k, v in zip(children[::2], children[1::2], strict=True)}
+    msg = f"unexpected plist element {tag}"
+    raise ValueError(msg)
+
+
+def read_plist_keys(f, keys):
+    """
+    Streams the XML plist in the binary file f, returning a dict of just the
+    given keys of its top-level dict. The values of other keys are skipped
+    as they are read, never becoming Python objects.
+    """
+
+    values = {}
+    key = None
+    depth = 0
+    for event, element in ElementTree.iterparse(f, events=("start", "end")):  # noqa: S314 - pkginfos are repo files, as with plistlib
+        if event == "start":
+            depth += 1
+            if depth == 2 and element.tag != "dict":
+                msg = f"top-level {element.tag} is not a dict"
+                raise ValueError(msg)
+            continue
+
+        # Elements at depth 3 alternate between the top-level dict's keys and values
+        if depth == 3:
+            if element.tag == "key":
+                key = element.text or ""
+            elif key in keys:
+                values[key] = plist_value(element)
+            element.clear()
+        depth -= 1
+    return values
+
+
+def read_pkg_record(pkginfo, keys, data=None):
+    """Returns a PkgRecord of keys from a pkginfo plist, or, if a parsing error occurs, None. data is as for safe_read_pkg."""
+
+    logger.debug(f"parsing {pkginfo}")
+    try:
+        with open(pkginfo, "rb") if data is None else io.BytesIO(data) as f:
+            return PkgRecord(read_plist_keys(f, keys))
+    except (ElementTree.ParseError, ValueError):
+        # Binary plists and clutter: safe_read_pkg reads the former and warns about the latter
+        pass
+
+    plist = safe_read_pkg(pkginfo, data)
+    if plist is None:
+        return None
+    if not isinstance(plist, dict):
+        logger.warning(f"Ignoring {pkginfo}, which is not a dict")
+        return None
+    return PkgRecord.from_plist(plist, keys)
+
+
+def load_state(path, version):
+    """
+    Returns the state a previous run saved at path with save_state, such as
+    the parse cache. Returns None if it is missing, unreadable or of another version.
+    """
 
-    return r.datetime
+    try:
+        with open(path, "rb") as f:
+            saved_version, state = pickle.load(f)  # noqa: S301 - written only by save_state
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable {path}: {e!r}")
+        return None
 
+    return state if saved_version == version else None
 
-def get_previous_pkg(current):
-    """Returns the previous version of package in PKGINFOS_PATHS"""
 
-    last = None
-    current_version = pkg_version(current)
-    for plist, _pkginfo in PKGINFOS_PATHS:
-        if plist["name"] == current["name"] and plist["version"] != current["version"]:
-            plist_version = pkg_version(plist)
-            if last:
-                last_version = pkg_version(last)
-                last = last if plist_version < last_version else plist if plist_version < current_version else last
-            else:
-                last = plist
-    if last:
-        logger.debug(
-            f"Determined that previous version of {current['name']} {current['version']} is {last['name']} {last['version']}"
-        )
-    else:
-        logger.warning(f"found no previous packages for {current['name']}")
+def save_state(path, version, state):
+    """Atomically replaces the state at path"""
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump((version, state), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning(f"Failed to write {path}: {e!r}")
 
-    return last
 
+def file_digest(path):
+    """Returns the SHA-256 hex digest of the file at path"""
 
-def get_force_install_days(catalog):
-    """Returns the number of days a package should live in a catalog, as configured"""
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
 
-    days = CONFIG["catalogs"].get(catalog, {}).get("force_install_days")
-    if not isinstance(days, int):
-        days = CONFIG["force_install_days"]
 
-    return days
+def parse_if_present(parse, path):
+    """Returns parse(path), or None if path was deleted since it was listed"""
+
+    try:
+        return parse(path)
+    except FileNotFoundError:
+        logger.warning(f"{path} disappeared before it could be read")
+        return None
+
+
+class RepoConflictError(Exception):
+    """Raised when writing a file that changed since it was read, which would lose that change"""
 
 
-def get_ideal_catalogs(catalogs):
+class LocalRepo:
     """
-    Given a list of catalogs, returns the catalog which appears last
-    in CONFIG['catalog_order'] and and the list of catalogs leading up to that catalog
+    A munki repo on the local filesystem. Paths are filesystem paths, and the
+    version of a file, which tells whether it changed, is its (size, mtime_ns).
     """
 
-    custom_catalogs = [c for c in catalogs if c not in CONFIG["catalog_order"]]
-    config_catalogs = [c for c in CONFIG["catalog_order"] if c in catalogs]
-    latest_catalog = None if not config_catalogs else config_catalogs[-1]
+    def __init__(self, root):
+        self.root = root
 
-    if latest_catalog:
-        new_catalogs = []
-        for c in CONFIG["catalog_order"]:
-            new_catalogs.append(c)
-            if c == latest_catalog:
-                break
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
 
-        new_catalogs = new_catalogs + custom_catalogs
-    else:
-        new_catalogs = catalogs
+    def list(self, directory):
+        """Returns path -> version for every file below directory"""
+
+        versions = {}
+        for path in get_pkgs(directory):
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                logger.warning(f"Failed to stat {path}: {e!r}")
+                continue
+            versions[path] = (st.st_size, st.st_mtime_ns)
+        return versions
+
+    def version(self, path):
+        """Returns the version of path, or None if it doesn't exist"""
+
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return (st.st_size, st.st_mtime_ns)
+
+    def names(self, directory):
+        """Returns the names of the files directly in directory, except hidden ones"""
+
+        try:
+            return {name for name in os.listdir(directory) if not name.startswith(".")}
+        except FileNotFoundError:
+            return set()
+
+    def digest(self, path, version):
+        """Returns a hash of the contents of path, at version"""
+
+        return file_digest(path)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            return f.read()
+
+    def read_many(self, paths, parse, workers):
+        """
+        Returns parse(path) for each of paths, in a process pool when there are
+        enough to be worth it. Files deleted since they were listed parse as None.
+        """
+
+        parse = partial(parse_if_present, parse)
+        if workers > 1 and len(paths) >= PARALLEL_PARSE_MIN:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                return list(pool.map(parse, paths, chunksize=64))
+        return [parse(path) for path in paths]
+
+    def write_plist(self, path, plist, version=None):
+        """
+        Atomically replaces the plist at path, keeping its permissions, and
+        returns its new version. If version is given and path is no longer
+        at it, raises RepoConflictError instead.
+        """
+
+        if version is not None and self.version(path) != version:
+            raise RepoConflictError(path)
+
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".autopromote-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                plistlib.dump(plist, f)
+            try:
+                os.chmod(tmp, os.stat(path).st_mode & 0o7777)
+            except FileNotFoundError:
+                os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return self.version(path)
 
-    return latest_catalog, new_catalogs
+    def remove(self, path):
+        os.remove(path)
 
 
-def get_next_catalog(latest_catalog):
-    """Returns the next catalog configured in the promotion schedule"""
+class S3Repo:
+    """
+    A munki repo in S3 or S3-compatible object storage (eg MinIO), for a
+    munki_repo of s3://bucket/prefix; needs boto3. Paths are s3:// URLs, and
+    the version of an object is its (size, ETag). Listings are paginated,
+    reads run in parallel and writes of a version are conditional on it
+    (If-Match), so a pkginfo re-imported mid-run is not overwritten.
+    """
 
-    for i, catalog in enumerate(CONFIG["catalog_order"]):
-        if catalog == latest_catalog:
-            try:
-                return CONFIG["catalog_order"][i + 1]
-            except IndexError:
+    def __init__(self, url, endpoint_url=None, workers=16):
+        if boto3 is None:
+            msg = "boto3 is required for an s3:// munki_repo"
+            raise ImportError(msg)
+        parsed = urlparse(url)
+        self.bucket = parsed.netloc
+        self.root = f"s3://{self.bucket}/{parsed.path.strip('/')}".rstrip("/")
+        self.workers = workers
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def path(self, *parts):
+        return "/".join((self.root, *parts))
+
+    def key(self, path):
+        return path.removeprefix(f"s3://{self.bucket}/")
+
+    def list(self, directory):
+        """Returns path -> version for every object below directory"""
+
+        versions = {}
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.key(directory)}/"):
+            for obj in page.get("Contents", []):
+                versions[f"s3://{self.bucket}/{obj['Key']}"] = (obj["Size"], obj["ETag"])
+        return versions
+
+    def version(self, path):
+        """Returns the version of path, or None if it doesn't exist"""
+
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(path))
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
                 return None
+            raise
+        return (head["ContentLength"], head["ETag"])
+
+    def names(self, directory):
+        """Returns the names of the objects directly in directory, except hidden ones"""
+
+        names = (path.removeprefix(f"{directory}/") for path in self.list(directory))
+        return {name for name in names if "/" not in name and not name.startswith(".")}
+
+    def digest(self, path, version):
+        """Returns a hash of the contents of path, at version"""
 
-    return None
+        # The ETag of an object is derived from its contents alone
+        return version[1]
 
+    def read(self, path):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(path))["Body"].read()
+        except self.client.exceptions.NoSuchKey as e:
+            raise FileNotFoundError(path) from e
 
-def get_channel_multiplier(plist):
-    """Retrieve the float multiplier for plist's channel. Returns multiplier or 1"""
+    def read_many(self, paths, parse, workers=None):
+        """
+        Returns parse(path, data) for each of paths, fetching them in parallel.
+        Objects deleted since they were listed parse as None.
+        """
 
-    channel = plist.get("_metadata", {}).get("channel")
-    if channel is None:
-        return 1.0
+        def fetch(path):
+            try:
+                return self.read(path)
+            except FileNotFoundError:
+                logger.warning(f"{path} disappeared before it could be read")
+                return None
 
-    multiplier = CONFIG.get("channels", {}).get(channel)
-    if not isinstance(multiplier, (int, float)) or multiplier == 0:
-        return 1.0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return [
+                None if data is None else parse(path, data=data)
+                for path, data in zip(paths, pool.map(fetch, paths), strict=True)
+            ]
+
+    def write_plist(self, path, plist, version=None):
+        """
+        Replaces the plist at path and returns its new version. If version is
+        given and path is no longer at it, raises RepoConflictError instead.
+        """
+
+        data = plistlib.dumps(plist)
+        condition = {} if version is None else {"IfMatch": version[1]}
+        try:
+            response = self.client.put_object(Bucket=self.bucket, Key=self.key(path), Body=data, **condition)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "412"):
+                raise RepoConflictError(path) from e
+            raise
+        return (len(data), response["ETag"])
+
+    def remove(self, path):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(path))
+
+
+def read_pkgs(repo, versions, cache=None, workers=None, keys=None):
+    """
+    Parses the pkginfos of repo in versions, a dict of path -> version: into
+    PkgRecords of keys if given, else in full by safe_read_pkg. pkginfos whose
+    version matches their entry in cache are not read again.
 
-    return float(multiplier)
+    Returns a list of (plist, path) for every parseable pkginfo, in the order
+    of versions, and the updated cache.
+    """
 
+    cache = cache or {}
+    workers = workers or os.cpu_count() or 1
+    new_cache = {}
+    misses = []
 
-def permitted(name, version):
-    match = lambda lst: lst.get(name) and lst[name].match(version)
-    allowed = match(CONFIG["allowlist"])
-    denied = match(CONFIG["denylist"])
+    for path, key in versions.items():
+        entry = cache.get(path)
+        if entry is not None and entry[0] == key:
+            new_cache[path] = entry
+        else:
+            misses.append((path, key))
 
-    if allowed and denied:
-        raise f"{name} is in both allow and deny lists!"
+    logger.info(f"{len(new_cache)} pkginfos unchanged since last run, parsing {len(misses)}")
 
-    if not allowed and CONFIG["allowlist"].get(name):
-        logger.warning(f"Skipping {name}-{version}: {name} is in allowlist but version {version} not matched")
-        return False
-    elif denied:
-        logger.warning(f"Skipping {name}-{version}: in denylist")
-        return False
+    parse = safe_read_pkg if keys is None else partial(read_pkg_record, keys=keys)
+    parsed = repo.read_many([path for path, _key in misses], parse, workers)
 
-    return True
+    for (path, key), plist in zip(misses, parsed, strict=True):
+        # Unparseable files are cached too, so clutter is not re-read every run
+        new_cache[path] = (key, plist)
 
+    pkgs = [(entry[1], path) for path in versions if (entry := new_cache.get(path)) and entry[1] is not None]
+    return pkgs, new_cache
 
-def promote_pkg(current_plist, path):  # noqa: C901
+
+class VersionIndex:
+    """
+    The version history of every package in the repo. pkginfos are grouped by
+    name up front; a name's versions are parsed once and sorted the first time
+    it is looked up, after which finding a previous version is a bisect.
     """
-    Given a pkginfo plist, parse its catalogs, apply a new catalog (promotion)
-    and shift force_install_after_date if neccessary.
 
-    Returns a boolean promoted and a dict results
+    def __init__(self, pkginfos):
+        self.by_name = defaultdict(list)
+        for plist, _path in pkginfos:
+            self.by_name[plist["name"]].append(plist)
+        self._sorted = {}
+
+    def history(self, name):
+        """Returns (versions, plists) for name, both sorted by version"""
+
+        if name not in self._sorted:
+            # sorted() is stable, so of several pkginfos with one version the last found sorts last
+            keyed = sorted(((pkg_version(p), p) for p in self.by_name.get(name, ())), key=lambda e: e[0])
+            self._sorted[name] = ([v for v, _p in keyed], [p for _v, p in keyed])
+        return self._sorted[name]
+
+    def previous(self, current):
+        """Returns the pkginfo with the highest version lower than current's, or None"""
+
+        versions, plists = self.history(current["name"])
+        i = bisect_left(versions, pkg_version(current))
+        return plists[i - 1] if i else None
+
+
+def normalize_plist(value):
+    """
+    Returns value as plistlib would read it back after writing it: datetimes
+    are stored without timezone or microseconds.
     """
 
-    name = current_plist["name"]
-    version = current_plist["version"]
-    catalogs = current_plist["catalogs"]
-    fullname = f"{name} {version}"
-    plist = current_plist.copy()
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None, microsecond=0)
+    if isinstance(value, (dict, PkgRecord)):
+        return {k: normalize_plist(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize_plist(v) for v in value]
+    return value
 
-    promoted = False
-    result = {"plist": plist, "from": None, "to": None, "fullname": fullname}
 
-    logger.info(f"Considering package {fullname}")
+def pkginfo_changed(original, updated):
+    """Returns True if writing updated would change the pkginfo original was read from"""
 
-    if not permitted(name, version):
-        return promoted, result
+    # Plain comparison settles nearly every pkginfo; only normalize when it disagrees
+    return updated != original and normalize_plist(updated) != normalize_plist(original)
 
-    if (
-        CONFIG["enforce_force_install_time"]
-        and CONFIG.get("force_install_time")
-        and plist.get("force_install_after_date")
-    ):
-        plist["force_install_after_date"] = get_force_install_time(plist)
 
-    latest_catalog, ideal_catalogs = get_ideal_catalogs(catalogs)
-    plist["catalogs"] = ideal_catalogs
+def plist_timestamp(value):
+    """Returns a plist date (naive, so UTC) or date string as a POSIX timestamp, or NaN if unset"""
 
-    logger.debug(f"Package {fullname} has a catalog of {latest_catalog}")
-    promotion_period = CONFIG["catalogs"].get(latest_catalog, {}).get("days")
-    logger.debug(f"Promotion period for package {fullname} is {promotion_period}")
+    if not value:
+        return nan
+    if isinstance(value, datetime):
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+    return arrow.get(value).timestamp()
 
-    if promotion_period is None:
-        logger.debug(f"No defined promotion period for {latest_catalog} catalog, skipping")
-        return promoted, result
 
-    last_promoted = plist.get("_metadata", {}).get("last_promoted")
-    if last_promoted is None:
-        logger.debug(f"Package {fullname} has no last_promoted value!")
+class PromotionEvaluator:
+    """
+    Evaluates the promotion schedule for a whole repo against one frozen now.
+
+    Catalog ranks, promotion periods and channel multipliers are resolved from
+    the promoter's config once, and due-for-promotion is computed for every package in a
+    single pass over arrays of timestamps, periods and multipliers. Only the
+    packages promote_pkg could change - due ones, first-time imports and those
+    whose catalogs or force install time need correcting - are returned as
+    candidates for the full per-package logic.
+    """
+
+    def __init__(self, promoter, now=None):
+        self.promoter = promoter
+        self.config = promoter.config
+        self.now = now or arrow.now()
+        self.order = self.config["catalog_order"]
+        self.rank = {catalog: i for i, catalog in enumerate(self.order)}
+        self.periods = [self.config["catalogs"][catalog].get("days") for catalog in self.order]
+        self.multipliers = {
+            channel: float(m)
+            for channel, m in self.config.get("channels", {}).items()
+            if isinstance(m, (int, float)) and m != 0
+        }
+
+        self.force_install_time = None
+        if self.config["enforce_force_install_time"] and self.config.get("force_install_time"):
+            patch_day = self.config.get("patch_tuesday")
+            self.force_install_time = (
+                int(self.config["force_install_time"]["hour"] or 0),
+                int(self.config["force_install_time"]["minute"] or 0),
+                patch_day if isinstance(patch_day, int) and 0 <= patch_day <= 6 else None,
+            )
 
-        # Is newly imported package
-        if latest_catalog == CONFIG["catalog_order"][0]:
-            last_promoted = plist["_metadata"].get("creation_date")
+    def latest_rank(self, catalogs):
+        """Returns the rank of the last configured catalog in catalogs, or -1"""
 
-            previous_pkg = get_previous_pkg(plist)
+        return max((self.rank[c] for c in catalogs if c in self.rank), default=-1)
 
-            if previous_pkg:
-                for key in CONFIG["fields_to_copy"]:
-                    # Only copy the previous field if the new plist does not contain a conflicting value
-                    if previous_pkg.get(key) and not plist.get(key):
-                        plist[key] = previous_pkg[key]
-            else:
-                logger.info(f"No previous package found for {fullname}!")
+    def promoted_at(self, plist, latest):
+        """
+        Returns the timestamp plist's promotion period counts from: its
+        last_promoted, or for a first-time import its creation_date. NaN if unset.
+        """
 
-    last_promoted = arrow.get(last_promoted) if last_promoted else None
+        metadata = plist.get("_metadata", {})
+        last = metadata.get("last_promoted")
+        if last is None and latest == 0:
+            last = metadata.get("creation_date")
+        return plist_timestamp(last)
 
-    if last_promoted is None:
-        promotion_due = False
-    else:
-        channel_shifted = promotion_period * get_channel_multiplier(plist)
-        logger.debug(f"Channel-shifted promotion period for {fullname} is {channel_shifted}")
+    def next_due(self, plist):
+        """Returns the timestamp plist falls due for its next promotion, or NaN if it never will"""
 
-        since_last_promotion = arrow.now() - last_promoted
-        days_since_last_promotion = since_last_promotion.days + since_last_promotion.seconds / SECONDS_IN_DAY
-        logger.debug(f"{fullname} was last promoted {days_since_last_promotion} days ago")
+        latest = self.latest_rank(plist["catalogs"])
+        if latest < 0 or latest + 1 >= len(self.order) or self.periods[latest] is None:
+            return nan
+        if self.promoter.denial_reason(plist["name"], plist["version"]):
+            return nan
 
-        promotion_due = days_since_last_promotion >= channel_shifted
+        multiplier = self.multipliers.get(plist.get("_metadata", {}).get("channel"), 1.0)
+        return self.promoted_at(plist, latest) + self.periods[latest] * multiplier * SECONDS_IN_DAY
 
-    if not promotion_due:
-        return promoted, result
+    def needs_correction(self, plist, latest):
+        """Returns True if promote_pkg would rewrite plist's catalogs or force install time"""
 
-    next_catalog = CONFIG["catalogs"][latest_catalog]["next"]
-    if next_catalog is None:
-        if promotion_period is not None:
-            msg = "Cannot define a next catalog without a promotion period."
-            raise ValueError(msg)
-        return promoted, result
+        catalogs = plist["catalogs"]
+        if latest >= 0 and catalogs != self.order[: latest + 1] + [c for c in catalogs if c not in self.rank]:
+            return True
+
+        force_install = plist.get("force_install_after_date")
+        if self.force_install_time and force_install:
+            hour, minute, patch_day = self.force_install_time
+            f = arrow.get(force_install)
+            return (f.hour, f.minute) != (hour, minute) or (patch_day is not None and f.weekday() != patch_day)
+
+        return False
+
+    def candidates(self, pkginfos):
+        """Returns the (plist, path) pairs in pkginfos which promote_pkg may change"""
+
+        last_promoted = array("d")
+        periods = array("d")
+        multipliers = array("d")
+        candidate = []
+
+        for plist, _path in pkginfos:
+            latest = self.latest_rank(plist["catalogs"])
+            metadata = plist.get("_metadata", {})
+            last = metadata.get("last_promoted")
+            period = self.periods[latest] if latest >= 0 else None
+
+            # First-time imports have fields copied from their previous version whether due or not
+            first_import = last is None and latest == 0 and period is not None
+            if first_import:
+                last = metadata.get("creation_date")
+
+            last_promoted.append(plist_timestamp(last))
+            periods.append(nan if period is None else period)
+            multipliers.append(self.multipliers.get(metadata.get("channel"), 1.0))
+            candidate.append(first_import or self.needs_correction(plist, latest))
+
+        # NaN (no period, or never promoted) compares False, so those are never due.
+        # Whole seconds only, as promote_pkg ignores the microseconds of the timedelta.
+        now = self.now.timestamp()
+        due = [
+            (now - last) // 1 / SECONDS_IN_DAY >= period * multiplier
+            for last, period, multiplier in zip(last_promoted, periods, multipliers, strict=True)
+        ]
+
+        return [pkg for pkg, d, c in zip(pkginfos, due, candidate, strict=True) if d or c]
+
+    def forecast(self, pkginfos, days):
+        """
+        Projects the promotions of every package over the next days days,
+        assuming autopromote runs once a day at the time of self.now.
+
+        Rather than replaying promote_pkg for each simulated day, every pass
+        over the repo advances all packages still in play by one catalog: the
+        next promotion is the first daily run after last_promoted plus the
+        channel-shifted period, which becomes the new last_promoted.
+
+        Returns a list of {"name", "version", "pkginfo", "catalog", "events"}
+        for the packages with at least one promotion in the horizon. Each
+        event has a "date", "from", "to" and the "force_install_after_date"
+        the promotion would set (or None).
+        """
+
+        now = self.now.timestamp()
+        end = now + days * SECONDS_IN_DAY
+
+        rows = []
+        ranks = []
+        last_promoted = array("d")
+        multipliers = array("d")
+
+        for plist, path in pkginfos:
+            name, version = plist["name"], plist["version"]
+            latest = self.latest_rank(plist["catalogs"])
+            last = self.promoted_at(plist, latest)
+
+            if latest < 0 or isnan(last) or self.promoter.denial_reason(name, version):
+                continue
+
+            rows.append({
+                "name": name,
+                "version": version,
+                "pkginfo": path,
+                "catalog": self.order[latest],
+                "events": [],
+            })
+            ranks.append(latest)
+            last_promoted.append(last)
+            multipliers.append(self.multipliers.get(plist.get("_metadata", {}).get("channel"), 1.0))
+
+        active = range(len(rows))
+        while active:
+            still_active = []
+            for i in active:
+                rank = ranks[i]
+                period = self.periods[rank]
+                if period is None or rank + 1 >= len(self.order):
+                    continue
+
+                due = last_promoted[i] + period * multipliers[i] * SECONDS_IN_DAY
+                promoted_at = now + max(0, ceil((due - now) / SECONDS_IN_DAY)) * SECONDS_IN_DAY
+                if promoted_at > end:
+                    continue
+
+                ranks[i] = rank + 1
+                last_promoted[i] = promoted_at
+                still_active.append(i)
+                rows[i]["events"].append({"date": promoted_at, "from": self.order[rank], "to": self.order[rank + 1]})
+            active = still_active
+
+        forecast = [row for row in rows if row["events"]]
+        self.annotate_forecast(forecast)
+        return forecast
+
+    def annotate_forecast(self, forecast):
+        """Replaces the timestamps of forecast events with datetimes and adds their force install dates"""
+
+        # Promotions only ever land on one of the daily runs, so there are few
+        # distinct (run, catalog) pairs to compute force install dates for.
+        force_installs = {}
+        denylist = self.config.get("force_install_denylist", [])
+        for row in forecast:
+            for event in row["events"]:
+                key = (event["date"], event["to"])
+                if key not in force_installs:
+                    force_installs[key] = self.forecast_force_install(event["to"], event["date"])
+                event["date"], force_install = force_installs[key]
+                event["force_install_after_date"] = None if row["name"] in denylist else force_install
+
+    def forecast_force_install(self, catalog, timestamp):
+        """
+        Returns the datetime of a run at timestamp and the force_install_after_date
+        promote_pkg would set promoting a package into catalog on that run.
+        """
+
+        promoted_at = arrow.get(timestamp).to(self.now.tzinfo)
+        if not self.config.get("enforce_force_install_date"):
+            return promoted_at.datetime, None
+
+        force_install = promoted_at.shift(days=+self.promoter.get_force_install_days(catalog)).datetime
+        if self.config.get("enforce_force_install_time") and self.config.get("force_install_time"):
+            force_install = self.promoter.get_force_install_time({"force_install_after_date": force_install})
+        return promoted_at.datetime, force_install
+
+
+def format_forecast(forecast, fmt="calendar"):
+    """Renders the result of PromotionEvaluator.forecast as JSON or as a calendar of promotions by day"""
+
+    if fmt == "json":
+        return json.dumps(forecast, indent=2, default=lambda d: d.isoformat())
+
+    by_day = defaultdict(list)
+    for row in forecast:
+        for event in row["events"]:
+            line = f"  {row['name']} {row['version']}: {event['from']} => {event['to']}"
+            if event["force_install_after_date"]:
+                line += (
+                    f" (force install after {arrow.get(event['force_install_after_date']).format('YYYY-MM-DD HH:mm')})"
+                )
+            by_day[event["date"].date()].append(line)
+
+    lines = []
+    for day in sorted(by_day):
+        lines.append(f"{day.isoformat()} ({day.strftime('%A')})")
+        lines.extend(sorted(by_day[day]))
+    return "\n".join(lines) if lines else "No promotions expected"
 
-    plist["catalogs"].append(next_catalog)
-    promoted = True
-    result["pkginfo"] = path
-    result["from"] = latest_catalog
-    result["to"] = next_catalog
-    plist["_metadata"]["last_promoted"] = arrow.now().datetime
-    if CONFIG.get("enforce_force_install_date") and name not in CONFIG.get("force_install_denylist", []):
-        plist["force_install_after_date"] = arrow.now().shift(days=+get_force_install_days(next_catalog)).datetime
 
-        if CONFIG.get("enforce_force_install_time") and CONFIG.get("force_install_time"):
-            plist["force_install_after_date"] = get_force_install_time(plist)
+def catalog_entry(plist):
+    """Returns a pkginfo as makecatalogs lists it: without admin notes or _ keys such as _metadata"""
 
-    logger.info(f"Promoted {fullname} from {result['from']} to {result['to']}")
+    return {k: v for k, v in plist.items() if k != "notes" and not k.startswith("_")}
+
+
+def catalog_membership(pkginfos):
+    """
+    Given a dict of pkginfo path -> plist, returns a dict of catalog name ->
+    sorted member paths, including the "all" catalog.
+    """
 
-    return promoted, result
+    membership = defaultdict(list)
+    for path in sorted(pkginfos):
+        membership["all"].append(path)
+        for catalog in pkginfos[path].get("catalogs", []):
+            if catalog:
+                membership[catalog].append(path)
+    return membership
 
 
-def promote_pkgs(pkginfos):
+def make_catalogs(repo, pkginfos, changed=None, previous=None, read=None):
+    """
+    Builds repo's catalogs from pkginfos (path -> plist) in-process,
+    in place of munki's makecatalogs. If pkginfos only hold the keys needed
+    to tell catalog membership (eg PkgRecords), read is called with the paths
+    of every pkginfo to fetch the full plists, but only if a catalog is to be
+    written.
+
+    changed is the set of pkginfo paths added, modified or removed since the
+    catalogs were last built, and previous maps those paths to the plists the
+    catalogs were built from. Only catalogs one of them was or is a member of,
+    and catalogs missing from the repo, are rewritten; if nothing changed, nothing
+    is. With changed None every catalog is rebuilt.
+
+    Returns the names of the catalogs written.
     """
-    Iterate over pkgs and pass them to promote_pkg if not in denylist.
 
-    Returns a list of results from promote_pkg.
+    catalogs_dir = repo.path("catalogs")
+    membership = catalog_membership(pkginfos)
+    existing = repo.names(catalogs_dir)
+
+    if changed is None:
+        affected = set(membership)
+    else:
+        affected = membership.keys() - existing
+        for path in changed:
+            for plist in (previous.get(path), pkginfos.get(path)):
+                if plist is not None:
+                    affected.add("all")
+                    affected.update(c for c in plist.get("catalogs", []) if c)
+
+    for name in sorted(existing - membership.keys()):
+        repo.remove(repo.path("catalogs", name))
+        logger.info(f"Removed catalog {name}, which no longer has any pkginfos")
+
+    written = sorted(affected & membership.keys())
+    if written and read is not None:
+        # Leaves out pkginfos deleted or broken since they were listed, as makecatalogs skips them
+        pkginfos = read(membership["all"])
+    for name in written:
+        entries = [catalog_entry(pkginfos[path]) for path in membership[name] if path in pkginfos]
+        repo.write_plist(repo.path("catalogs", name), entries)
+        logger.debug(f"wrote catalog {name} ({len(membership[name])} pkginfos)")
+
+    logger.info(f"Rebuilt {len(written)} of {len(membership)} catalogs")
+    return written
+
+
+class InotifyWatcher:
+    """
+    Watches a directory tree for files being written, moved or deleted, using
+    Linux inotify through ctypes. Watches are added for subdirectories as they
+    appear. Use available() to check for inotify before creating one.
     """
 
-    promotions = {}
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+    EVENT = struct.Struct("iIII")
+
+    _libc = None
+
+    @classmethod
+    def available(cls):
+        if cls._libc is None:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            cls._libc = libc if hasattr(libc, "inotify_init1") else False
+        return bool(cls._libc)
+
+    def __init__(self, root):
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs = {}  # watch descriptor -> directory
+        self.add_tree(root)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        os.close(self.fd)
+
+    def add_tree(self, root):
+        """Watches root and every directory below it. Returns the files found in them."""
+
+        files = []
+        for directory, _subdirs, names in os.walk(root):
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+            self.dirs[wd] = directory
+            files.extend(os.path.join(directory, name) for name in names)
+        return files
+
+    def wait(self, timeout=None):
+        """Returns True if events arrive within timeout seconds (None waits forever)"""
+
+        return bool(select.select([self], [], [], timeout)[0])
+
+    def read(self):
+        """
+        Drains the pending events. Returns the set of file paths affected and
+        whether the whole tree must be rescanned because events were lost or
+        a directory was moved or deleted.
+        """
+
+        changed = set()
+        rescan = False
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                return changed, rescan
 
-    for plist, path in pkginfos:
-        promoted, result = promote_pkg(plist, path)
-        if promoted:
-            promotions[result["fullname"]] = result
+            offset = 0
+            while offset < len(data):
+                wd, mask, _cookie, length = self.EVENT.unpack_from(data, offset)
+                name = data[offset + self.EVENT.size : offset + self.EVENT.size + length].rstrip(b"\0")
+                offset += self.EVENT.size + length
 
-        with open(path, "wb") as f:
-            plistlib.dump(result["plist"], f)
+                if mask & self.IN_Q_OVERFLOW or mask & self.IN_DELETE_SELF:
+                    rescan = True
+                elif wd in self.dirs and name:
+                    path = os.path.join(self.dirs[wd], os.fsdecode(name))
+                    if not mask & self.IN_ISDIR:
+                        changed.add(path)
+                    elif mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                        changed.update(self.add_tree(path))
+                    else:
+                        rescan = True
 
-        logger.debug(f"wrote {result['fullname']} to {path}")
 
-    return promotions
+# Slack errors worth retrying; any other means the message will never be accepted as is
+RETRYABLE_SLACK_ERRORS = {
+    "fatal_error",
+    "internal_error",
+    "rate_limited",
+    "ratelimited",
+    "request_timeout",
+    "service_unavailable",
+}
 
 
-def notify_slack(promotions, error):
+class SlackRejectedError(Exception):
+    """Raised when Slack refuses a message for good (eg invalid_auth, channel_not_found)"""
+
+
+def slack_error_retryable(error):
+    """Returns True if the SlackApiError error is transient: rate limiting or a Slack outage"""
+
+    status = getattr(error.response, "status_code", 0) or 0
+    return error.response.get("error") in RETRYABLE_SLACK_ERRORS or status == 429 or status >= 500
+
+
+class SlackOutbox:
     """
-    Given a list of results from promote_pkgs, send a slack alert with a summary
+    Slack messages waiting to be sent, kept as one JSON file each in
+    directory. Queuing a message never touches the network, and a message
+    Slack can't take right now stays queued for the next flush rather than
+    being lost. flush() posts whatever is pending, several runs' messages to
+    a channel at a time, retrying transient failures with exponential backoff.
+
+    Messages Slack rejects outright, and those still undelivered after
+    max_attempts flushes or max_age seconds, are moved to directory/failed
+    instead, so they can't hold up the messages queued after them.
     """
 
-    # Generate our Slack WebClient
-    token = os.environ.get("SLACK_TOKEN")
-    sslcert = SSLContext(PROTOCOL_TLS_CLIENT)
-    sslcert.load_verify_locations(certifi.where())
-    client = WebClient(token=token, ssl=sslcert)
-    if not token:
-        logger.error("No SLACK_TOKEN is in environment, skipping slack output")
-        return
-    # Build out the Slack message attachment showing what was promoted
-    attachments = {
-        "fields": [
-            {"title": pkg, "value": f"{result['from']} => {result['to']}"} for pkg, result in promotions.items()
-        ],
-        "color": "danger" if error else "good",
-        "title": "Autopromotion run completed",
-        "text": "" if promotions else "No packages promoted" if not error else f"Error: {error}",
-        "footer": "Alerts #withGusto",
-    }
-    logger.debug(promotions)
-    logger.debug(attachments)
-    # Actually send the Slack message
-    try:
-        client.chat_postMessage(
-            channel=CONFIG.get("slack_channel", "#test-please-ignore"),
-            text="new autopromote.py run complete",
-            username="munki autopromoter",
-            icon_emoji=":munki:",
-            attachments=[attachments],
+    BATCH = 20  # attachments per Slack message; Slack takes up to 100 but advises fewer
+    FAILED_KEEP = 100  # dead-lettered messages kept for inspection
+
+    def __init__(self, directory, retries=5, backoff=2, max_attempts=10, max_age=SECONDS_IN_DAY):
+        self.directory = directory
+        self.retries = retries
+        self.backoff = backoff
+        self.max_attempts = max_attempts
+        self.max_age = max_age
+
+    def put(self, channel, attachment):
+        """Queues attachment for channel"""
+
+        # Named by time, so pending() returns messages in the order they were queued
+        self.write(
+            os.path.join(self.directory, f"{time.time_ns()}-{os.getpid()}.json"),
+            {"channel": channel, "attachment": attachment},
+        )
+
+    def write(self, path, message):
+        """Atomically writes message to path in the outbox"""
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        with os.fdopen(fd, "w") as f:
+            json.dump(message, f)
+        os.replace(tmp, path)
+
+    def pending(self):
+        """Returns the paths of the queued messages, oldest first"""
+
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        return [os.path.join(self.directory, name) for name in sorted(names) if name.endswith(".json")]
+
+    def flush(self, token):
+        """
+        Posts every queued message, batched by channel. Returns False if
+        Slack could not be reached (the messages stay queued), else True.
+        Only one flush runs per directory at a time; others return at once.
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+
+            sslcert = SSLContext(PROTOCOL_TLS_CLIENT)
+            sslcert.load_verify_locations(certifi.where())
+            client = WebClient(token=token, ssl=sslcert)
+
+            # Runs finishing while we post queue more, so look again until there's nothing left
+            while paths := self.pending():
+                batches = defaultdict(list)
+                for path in paths:
+                    if (message := self.load(path)) is not None:
+                        batches[message["channel"]].append((path, message))
+
+                for channel, batch in batches.items():
+                    for i in range(0, len(batch), self.BATCH):
+                        if not self.send(client, channel, batch[i : i + self.BATCH]):
+                            return False
+        return True
+
+    def load(self, path):
+        """
+        Returns the queued message at path, or None if it is unreadable or
+        past max_attempts or max_age, in which case it is dead-lettered.
+        """
+
+        try:
+            with open(path) as f:
+                message = json.load(f)
+        except ValueError:
+            reason = "unreadable"
+        else:
+            age = time.time() - int(os.path.basename(path).split("-")[0]) / 1e9
+            if message.get("attempts", 0) >= self.max_attempts:
+                reason = f"not delivered in {message['attempts']} attempts"
+            elif age > self.max_age:
+                reason = f"not delivered in {age / 3600:.0f} hours"
+            else:
+                return message
+        self.dead_letter(path, reason)
+        return None
+
+    def send(self, client, channel, chunk):
+        """
+        Posts chunk, a list of (path, message), as one Slack message and
+        removes it from the outbox. If Slack rejects it, its messages are
+        retried one at a time, so only the bad ones are dead-lettered.
+        Returns False if Slack could not be reached, counting an attempt
+        against each message of chunk, which stays queued.
+        """
+
+        try:
+            sent = self.post(client, channel, [message["attachment"] for _path, message in chunk])
+        except SlackRejectedError as e:
+            if len(chunk) > 1:
+                return all(self.send(client, channel, [item]) for item in chunk)
+            self.dead_letter(chunk[0][0], f"rejected by Slack: {e}")
+            return True
+
+        for path, message in chunk:
+            if sent:
+                os.remove(path)
+            else:
+                self.write(path, {**message, "attempts": message.get("attempts", 0) + 1})
+        return sent
+
+    def dead_letter(self, path, reason):
+        """Moves the message at path to the failed subdirectory, where it is kept but never sent"""
+
+        failed = os.path.join(self.directory, "failed")
+        os.makedirs(failed, exist_ok=True)
+        os.replace(path, os.path.join(failed, os.path.basename(path)))
+        logger.error(f"Dropped Slack message {os.path.basename(path)} ({reason}), kept in {failed}")
+        for name in sorted(os.listdir(failed))[: -self.FAILED_KEEP]:
+            os.remove(os.path.join(failed, name))
+
+    def post(self, client, channel, attachments):
+        """
+        Posts attachments to channel in one message, retrying transient
+        failures with backoff. Returns True once sent, False if Slack could
+        not be reached; raises SlackRejectedError if Slack refused it.
+        """
+
+        text = (
+            "new autopromote.py run complete"
+            if len(attachments) == 1
+            else f"{len(attachments)} autopromote.py runs complete"
         )
-    except SlackApiError as e:
-        logger.exception(f"Slack error: {e.response['error']}")
+        delay = 0
+        for attempt in range(self.retries):
+            time.sleep(delay)
+            try:
+                client.chat_postMessage(
+                    channel=channel,
+                    text=text,
+                    username="munki autopromoter",
+                    icon_emoji=":munki:",
+                    attachments=attachments,
+                )
+            except SlackApiError as e:
+                if not slack_error_retryable(e):
+                    raise SlackRejectedError(e.response["error"]) from e
+                # Rate limited requests say when to come back
+                delay = float(e.response.headers.get("Retry-After", self.backoff * 2**attempt))
+                logger.warning(f"Slack error: {e.response.get('error') or e.response.status_code}")
+            except OSError as e:
+                delay = self.backoff * 2**attempt
+                logger.warning(f"Failed to reach Slack: {e!r}")
+            else:
+                return True
+
+        logger.error(f"Giving up on posting to {channel} after {self.retries} attempts, messages remain queued")
+        return False
 
 
-def output_results(promotions, error):
+class AutoPromoter:
     """
-    Given a list of results from promote_pkgs, write a file to disk
+    Promotes the pkginfos of one munki repo as configured in an autopromote.json.
+
+    Nothing is read when an AutoPromoter is created: the config, logger and
+    envfile are loaded on first use. The instance keeps its parsed config,
+    compiled allow/deny lists and parse cache between calls, so a long-lived
+    process can hold one and call run() repeatedly without paying startup
+    again. config, if given, is a parsed autopromote.json used instead of
+    reading config_file.
     """
 
-    file_path = CONFIG.get("output_results_path", "results.plist")
+    def __init__(self, config_file=None, config=None):
+        # With config given, config_file only says where it came from (if anywhere), for the Slack flusher
+        self.config_file = config_file or (CONFIG_FILE if config is None else None)
+        if config is not None:
+            self.config = prepare_config(config)
+        self.parse_cache = None  # path -> ((size, mtime_ns), PkgRecord) as of the last run
+        self.index = None
+        self.due_index = None  # pkginfo path -> ((size, mtime_ns), sha256, timestamp of its next promotion)
+        self.due_heap = []  # (timestamp, path) for the daemon, possibly stale: checked against due_index when popped
+        self.indexed_catalogs = set()  # catalogs on disk when the due index was saved
+        self._env_loaded = False
+        self._flush_wanted = None  # set to wake the flusher thread, once there is one
+
+    @cached_property
+    def config(self):
+        return load_config(self.config_file)
+
+    @cached_property
+    def logger(self):
+        return load_logger(self.config.get("logfile", "stdout"))
+
+    def load_env(self):
+        """Loads the configured envfile (eg SLACK_TOKEN) into the environment, once"""
+
+        if not self._env_loaded:
+            load_dotenv(dotenv_path=self.config.get("envfile", ".autopromote.env"))
+            self._env_loaded = True
+
+    @cached_property
+    def repo(self):
+        """The munki repo: in S3 for an s3:// munki_repo, else on the local filesystem"""
+
+        munki_repo = self.config["munki_repo"]
+        if munki_repo.startswith("s3://"):
+            return S3Repo(munki_repo, self.config.get("s3_endpoint_url"), self.config.get("s3_workers", 16))
+        return LocalRepo(munki_repo)
+
+    @property
+    def pkgsinfo(self):
+        return self.repo.path("pkgsinfo")
+
+    def parse_cache_path(self):
+        """Returns the path of the persistent pkginfo parse cache"""
+
+        cache_dir = os.path.expanduser(self.config.get("cache_dir", "~/.cache/autopromote"))
+        return os.path.join(cache_dir, "pkginfo_cache.pickle")
+
+    @cached_property
+    def record_keys(self):
+        """The pkginfo keys read into PkgRecords: those promotion looks at, and fields_to_copy"""
+
+        return tuple(sorted({*PKG_RECORD_SLOTS, *self.config["fields_to_copy"]}))
+
+    def get_force_install_time(self, plist):
+        """Returns a force install datetime shifted to match the configured force_install_time"""
+
+        f = arrow.get(plist["force_install_after_date"])
+        r = f.shift(
+            hours=(int(self.config["force_install_time"]["hour"] or 0) - f.hour),
+            minutes=(int(self.config["force_install_time"]["minute"] or 0) - f.minute),
+        )
 
-    with open(file_path, "wb") as f:
-        if error:
-            plistlib.dump(error, f)
+        patch_day = self.config.get("patch_tuesday")
+        if isinstance(patch_day, int) and patch_day <= 6 and patch_day >= 0:
+            r = r.shift(weekday=patch_day)
+
+        return r.datetime
+
+    def get_previous_pkg(self, current, index):
+        """Returns the previous version of package in index, a VersionIndex"""
+
+        last = index.previous(current)
+        if last:
+            self.logger.debug(
+                f"Determined that previous version of {current['name']} {current['version']} is {last['name']} {last['version']}"
+            )
         else:
-            plistlib.dump(promotions, f)
+            self.logger.warning(f"found no previous packages for {current['name']}")
 
+        return last
 
-def main():
-    logger.info("\n========================================\n")
-    repo = os.path.join(CONFIG["munki_repo"], "pkgsinfo")
-    logger.info("Autopromote: scanning munki_repo/pkgsinfo")
-    promotions = {}
-    error = None
-    try:
-        # Hello, this looks scary. It is not. We filter a list of packages
-        # by whether safe_read_pkg returns None or a parsed plist.
-        # This generates our list of valid packages to operate on.
-        pkgs = ((plist, path) for path in get_pkgs(repo) if (plist := safe_read_pkg(path)) is not None)
+    def get_force_install_days(self, catalog):
+        """Returns the number of days a package should live in a catalog, as configured"""
 
-        # We write that list to a global variable. Several functions iterate
-        # over it, and this seems cleaner than passing the value around or going full OO.
-        global PKGINFOS_PATHS
-        PKGINFOS_PATHS = list(pkgs)
+        days = self.config["catalogs"].get(catalog, {}).get("force_install_days")
+        if not isinstance(days, int):
+            days = self.config["force_install_days"]
 
-        # Let's do the promoting!
-        promotions = promote_pkgs(PKGINFOS_PATHS)
+        return days
+
+    def get_ideal_catalogs(self, catalogs):
+        """
+        Given a list of catalogs, returns the catalog which appears last
+        in self.config['catalog_order'] and and the list of catalogs leading up to that catalog
+        """
+
+        custom_catalogs = [c for c in catalogs if c not in self.config["catalog_order"]]
+        config_catalogs = [c for c in self.config["catalog_order"] if c in catalogs]
+        latest_catalog = None if not config_catalogs else config_catalogs[-1]
+
+        if latest_catalog:
+            new_catalogs = []
+            for c in self.config["catalog_order"]:
+                new_catalogs.append(c)
+                if c == latest_catalog:
+                    break
+
+            new_catalogs = new_catalogs + custom_catalogs
+        else:
+            new_catalogs = catalogs
+
+        return latest_catalog, new_catalogs
+
+    def get_next_catalog(self, latest_catalog):
+        """Returns the next catalog configured in the promotion schedule"""
+
+        for i, catalog in enumerate(self.config["catalog_order"]):
+            if catalog == latest_catalog:
+                try:
+                    return self.config["catalog_order"][i + 1]
+                except IndexError:
+                    return None
+
+        return None
+
+    def get_channel_multiplier(self, plist):
+        """Retrieve the float multiplier for plist's channel. Returns multiplier or 1"""
+
+        channel = plist.get("_metadata", {}).get("channel")
+        if channel is None:
+            return 1.0
+
+        multiplier = self.config.get("channels", {}).get(channel)
+        if not isinstance(multiplier, (int, float)) or multiplier == 0:
+            return 1.0
+
+        return float(multiplier)
+
+    def denial_reason(self, name, version):
+        """Returns why the allow and deny lists block promoting name-version, or None"""
+
+        match = lambda lst: lst.get(name) and lst[name].match(version)
+        allowed = match(self.config["allowlist"])
+        denied = match(self.config["denylist"])
+
+        if allowed and denied:
+            raise f"{name} is in both allow and deny lists!"
+
+        if not allowed and self.config["allowlist"].get(name):
+            return f"{name} is in allowlist but version {version} not matched"
+        elif denied:
+            return "in denylist"
+
+        return None
+
+    def permitted(self, name, version):
+        reason = self.denial_reason(name, version)
+        if reason:
+            self.logger.warning(f"Skipping {name}-{version}: {reason}")
+            return False
+
+        return True
+
+    def promote_pkg(self, current_plist, path, index, now=None):  # noqa: C901
+        """
+        Given a pkginfo plist, parse its catalogs, apply a new catalog (promotion)
+        and shift force_install_after_date if neccessary. index is the VersionIndex
+        of the repo, used to find the previous version of newly imported packages.
+        now is the arrow time the run is evaluated at, by default the current time.
+
+        Returns a boolean promoted and a dict results
+        """
+
+        now = now or arrow.now()
+
+        name = current_plist["name"]
+        version = current_plist["version"]
+        catalogs = current_plist["catalogs"]
+        fullname = f"{name} {version}"
+        plist = current_plist.copy()
+        # Copy the nested values modified below too, so current_plist still matches
+        # the file on disk and promote_pkgs can tell whether anything changed.
+        plist["catalogs"] = list(catalogs)
+        if "_metadata" in plist:
+            plist["_metadata"] = plist["_metadata"].copy()
+
+        promoted = False
+        result = {"plist": plist, "from": None, "to": None, "fullname": fullname}
+
+        self.logger.info(f"Considering package {fullname}")
+
+        if not self.permitted(name, version):
+            return promoted, result
+
+        if (
+            self.config["enforce_force_install_time"]
+            and self.config.get("force_install_time")
+            and plist.get("force_install_after_date")
+        ):
+            plist["force_install_after_date"] = self.get_force_install_time(plist)
+
+        latest_catalog, ideal_catalogs = self.get_ideal_catalogs(catalogs)
+        plist["catalogs"] = ideal_catalogs
+
+        self.logger.debug(f"Package {fullname} has a catalog of {latest_catalog}")
+        promotion_period = self.config["catalogs"].get(latest_catalog, {}).get("days")
+        self.logger.debug(f"Promotion period for package {fullname} is {promotion_period}")
+
+        if promotion_period is None:
+            self.logger.debug(f"No defined promotion period for {latest_catalog} catalog, skipping")
+            return promoted, result
+
+        last_promoted = plist.get("_metadata", {}).get("last_promoted")
+        if last_promoted is None:
+            self.logger.debug(f"Package {fullname} has no last_promoted value!")
+
+            # Is newly imported package
+            if latest_catalog == self.config["catalog_order"][0]:
+                last_promoted = plist["_metadata"].get("creation_date")
+
+                previous_pkg = self.get_previous_pkg(plist, index)
+
+                if previous_pkg:
+                    for key in self.config["fields_to_copy"]:
+                        # Only copy the previous field if the new plist does not contain a conflicting value
+                        if previous_pkg.get(key) and not plist.get(key):
+                            plist[key] = previous_pkg[key]
+                else:
+                    self.logger.info(f"No previous package found for {fullname}!")
+
+        last_promoted = arrow.get(last_promoted) if last_promoted else None
+
+        if last_promoted is None:
+            promotion_due = False
+        else:
+            channel_shifted = promotion_period * self.get_channel_multiplier(plist)
+            self.logger.debug(f"Channel-shifted promotion period for {fullname} is {channel_shifted}")
+
+            since_last_promotion = now - last_promoted
+            days_since_last_promotion = since_last_promotion.days + since_last_promotion.seconds / SECONDS_IN_DAY
+            self.logger.debug(f"{fullname} was last promoted {days_since_last_promotion} days ago")
+
+            promotion_due = days_since_last_promotion >= channel_shifted
+
+        if not promotion_due:
+            return promoted, result
+
+        next_catalog = self.config["catalogs"][latest_catalog]["next"]
+        if next_catalog is None:
+            if promotion_period is not None:
+                msg = "Cannot define a next catalog without a promotion period."
+                raise ValueError(msg)
+            return promoted, result
+
+        plist["catalogs"].append(next_catalog)
+        promoted = True
+        result["pkginfo"] = path
+        result["from"] = latest_catalog
+        result["to"] = next_catalog
+        plist["_metadata"]["last_promoted"] = now.datetime
+        if self.config.get("enforce_force_install_date") and name not in self.config.get("force_install_denylist", []):
+            plist["force_install_after_date"] = now.shift(days=+self.get_force_install_days(next_catalog)).datetime
+
+            if self.config.get("enforce_force_install_time") and self.config.get("force_install_time"):
+                plist["force_install_after_date"] = self.get_force_install_time(plist)
+
+        self.logger.info(f"Promoted {fullname} from {result['from']} to {result['to']}")
+
+        return promoted, result
+
+    def promote_pkgs(self, pkginfos, index=None, evaluator=None, versions=None):
+        """
+        Iterate over pkgs and pass them to promote_pkg if not in denylist.
+        Only pkginfos that promote_pkg changed are written back, unless
+        rewrite_unchanged is configured. index defaults to a VersionIndex
+        of pkginfos, evaluator (which picks the packages promote_pkg needs to
+        see) to a PromotionEvaluator at the current time.
+
+        versions maps paths to the version of the pkginfo they were read at.
+        A pkginfo changed since (eg re-imported) is left alone, and its
+        promotion dropped, rather than overwritten with stale contents.
+
+        Returns a dict of results from promote_pkg for the promoted packages and
+        a dict of path -> (version, plist) for the pkginfos written.
+        """
+
+        promotions = {}
+        dirty = []
+        written = {}
+        versions = versions or {}
+        rewrite_unchanged = self.config.get("rewrite_unchanged", False)
+        index = index or VersionIndex(pkginfos)
+        evaluator = evaluator or PromotionEvaluator(self)
+
+        candidates = pkginfos if rewrite_unchanged else evaluator.candidates(pkginfos)
+        self.logger.info(f"{len(candidates)} of {len(pkginfos)} pkginfos are due for promotion or correction")
+
+        for plist, path in candidates:
+            promoted, result = self.promote_pkg(plist, path, index, evaluator.now)
+            if promoted:
+                promotions[result["fullname"]] = result
+
+            if rewrite_unchanged or pkginfo_changed(plist, result["plist"]):
+                dirty.append((path, result))
+
+        # Nothing is written until every pkginfo has been evaluated, so an error
+        # part way through the run leaves the repo untouched.
+        for path, result in dirty:
+            try:
+                if isinstance(result["plist"], PkgRecord):
+                    # Only now is the whole pkginfo read, to write the record's keys back into it
+                    result["plist"] = self.merge_record(path, result["plist"], versions.get(path))
+                version = self.repo.write_plist(path, result["plist"], versions.get(path))
+            except RepoConflictError:
+                self.logger.warning(f"{path} changed while promoting, leaving it for the next run")
+                promotions.pop(result["fullname"], None)
+                continue
+            written[path] = (version, result["plist"])
+            self.logger.debug(f"wrote {result['fullname']} to {path}")
+
+        self.logger.info(f"Wrote {len(written)} of {len(pkginfos)} pkginfos")
+
+        return promotions, written
+
+    def merge_record(self, path, record, version=None):
+        """
+        Returns the whole pkginfo at path with the keys of record written into
+        it. Raises RepoConflictError if path is no longer at version, is gone
+        or no longer parses, as writing the record back would lose that change.
+        """
+
+        if version is not None and self.repo.version(path) != version:
+            raise RepoConflictError(path)
+        try:
+            plist = safe_read_pkg(path, self.repo.read(path))
+        except FileNotFoundError as e:
+            raise RepoConflictError(path) from e
+        if not isinstance(plist, dict):
+            raise RepoConflictError(path)
+        plist.update(record.items())
+        return plist
+
+    @cached_property
+    def outbox(self):
+        outbox_dir = os.path.join(os.path.dirname(self.parse_cache_path()), "outbox")
+        return SlackOutbox(
+            outbox_dir,
+            self.config.get("slack_retries", 5),
+            max_attempts=self.config.get("slack_max_attempts", 10),
+            max_age=self.config.get("slack_max_age", 24) * 3600,
+        )
+
+    def report(self, promotions, error):
+        """Sends the Slack summary and writes the results file of a run, as configured"""
+
+        if self.config.get("notify_slack"):
+            self.notify_slack(promotions, error)
+        if self.config.get("output_results"):
+            self.output_results(promotions, error)
+
+    def notify_slack(self, promotions, error):
+        """
+        Given a list of results from promote_pkgs, queue a slack alert with a
+        summary, and have it sent in the background
+        """
+
+        if not os.environ.get("SLACK_TOKEN"):
+            self.logger.error("No SLACK_TOKEN is in environment, skipping slack output")
+            return
+        # Build out the Slack message attachment showing what was promoted
+        attachments = {
+            "fields": [
+                {"title": pkg, "value": f"{result['from']} => {result['to']}"} for pkg, result in promotions.items()
+            ],
+            "color": "danger" if error else "good",
+            "title": "Autopromotion run completed",
+            "text": "" if promotions else "No packages promoted" if not error else f"Error: {error}",
+            "footer": "Alerts #withGusto",
+            "ts": int(time.time()),
+        }
+        self.logger.debug(promotions)
+        self.logger.debug(attachments)
+        self.outbox.put(self.config.get("slack_channel", "#test-please-ignore"), attachments)
+        self.start_flush()
+
+    def start_flush(self):
+        """
+        Sends the Slack outbox without waiting for it: from the flusher
+        thread in the daemon, from a detached process that outlives this one
+        if there is a config file to hand it, otherwise from a thread the
+        interpreter waits for at exit, so a one-shot run's message isn't lost.
+        """
+
+        if self._flush_wanted is not None:
+            self._flush_wanted.set()
+            return
+        if self.config_file is None:
+            threading.Thread(target=self.flush_outbox, name="autopromote-slack").start()
+            return
+
+        subprocess.Popen(  # noqa: S603
+            [sys.executable, os.path.abspath(__file__), "--flush-outbox"],
+            env={**os.environ, "CONFIG_FILE": self.config_file},
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+    def start_flusher(self):
+        """Starts the thread that sends the Slack outbox for this process, if it isn't running"""
+
+        if self._flush_wanted is None:
+            self._flush_wanted = threading.Event()
+            threading.Thread(target=self.flush_forever, name="autopromote-slack", daemon=True).start()
 
-        if CONFIG.get("run_makecatalogs", True):
-            logger.debug("Calling makecatalogs...")
+    def flush_forever(self):
+        """Flushes the Slack outbox each time start_flush asks, for the flusher thread"""
+
+        while True:
+            self._flush_wanted.wait()
+            self._flush_wanted.clear()
+            self.flush_outbox()
+
+    def flush_outbox(self):
+        """Sends the queued Slack messages, see SlackOutbox.flush. Returns False if some remain queued."""
+
+        self.load_env()
+        self.logger.debug(f"Flushing the Slack outbox {self.outbox.directory}")
+        return self.outbox.flush(os.environ.get("SLACK_TOKEN"))
+
+    def output_results(self, promotions, error):
+        """
+        Given a list of results from promote_pkgs, write a file to disk
+        """
+
+        file_path = self.config.get("output_results_path", "results.plist")
+
+        with open(file_path, "wb") as f:
+            if error:
+                plistlib.dump(error, f)
+            else:
+                plistlib.dump(promotions, f)
+
+    def read_repo(self):
+        """
+        Parses the repo's pkginfos, skipping those unchanged since the last run.
+
+        Returns a list of (plist, path), the updated parse cache and the cache
+        it was updated from, kept in memory between runs and read from disk
+        on the first.
+        """
+
+        self.logger.info("Autopromote: scanning munki_repo/pkgsinfo")
+        previous = self.load_parse_cache()
+        versions = self.repo.list(self.pkgsinfo)
+        pkgs, cache = read_pkgs(self.repo, versions, previous, self.config.get("parse_workers"), self.record_keys)
+        return pkgs, cache, previous
+
+    def load_parse_cache(self):
+        """Returns the parse cache from memory, or from disk on the first run. Empty if there is none."""
+
+        if self.parse_cache is None and self.config.get("parse_cache", True):
+            state = load_state(self.parse_cache_path(), PARSE_CACHE_VERSION)
+            # Records read for other fields_to_copy lack keys this config needs
+            self.parse_cache = state["pkginfos"] if state and state["keys"] == self.record_keys else None
+        return self.parse_cache or {}
+
+    def read_full_pkginfos(self, versions, paths, fresh=None):
+        """
+        Returns path -> full plist for the pkginfos at paths, whose versions
+        are looked up in versions (path -> version), for the catalog builder. Like the parse cache, these are cached in cache_dir between
+        runs, but only loaded when a catalog has to be written. fresh holds
+        cache entries for pkginfos this run has just written.
+        """
+
+        use_cache = self.config.get("parse_cache", True)
+        cache_path = os.path.join(os.path.dirname(self.parse_cache_path()), "catalog_cache.pickle")
+        previous = (load_state(cache_path, PARSE_CACHE_VERSION) if use_cache else None) or {}
+        previous.update(fresh or {})
+        wanted = {path: versions[path] for path in paths}
+        pkgs, cache = read_pkgs(self.repo, wanted, previous, self.config.get("parse_workers"))
+        if use_cache:
+            save_state(cache_path, PARSE_CACHE_VERSION, cache)
+        return {path: plist for plist, path in pkgs}
+
+    def due_index_path(self):
+        """Returns the path of the persistent next-due index"""
+
+        return os.path.join(os.path.dirname(self.parse_cache_path()), "due_index.pickle")
+
+    def load_due_index(self):
+        """Returns the saved next-due index if it was computed under the current config, else None"""
+
+        state = load_state(self.due_index_path(), DUE_INDEX_VERSION)
+        if not state or state["config"] != self.config["_digest"]:
+            return None
+        self.indexed_catalogs = set(state["catalogs"])
+        return state["pkginfos"]
+
+    def save_due_index(self):
+        """Writes the due index for the next run, tagged with the config it was computed under"""
+
+        state = {"config": self.config["_digest"], "pkginfos": self.due_index, "catalogs": sorted(self.catalog_names())}
+        save_state(self.due_index_path(), DUE_INDEX_VERSION, state)
+
+    def catalog_names(self):
+        """Returns the names of the catalogs in munki_repo"""
+
+        return self.repo.names(self.repo.path("catalogs"))
+
+    def scan(self, now):
+        """
+        Checks the version of every pkginfo against the due index without
+        reading unchanged ones. Files whose version changed are hashed, so a
+        touch or a fresh checkout of the same content doesn't count as a change.
+
+        Returns the paths added, removed or modified since the index was
+        saved, and those whose next promotion is due at now.
+        """
+
+        changed, due = set(), set()
+        versions = self.repo.list(self.pkgsinfo)
+        for path, key in versions.items():
+            entry = self.due_index.get(path)
+            try:
+                if entry is not None and entry[0] != key and self.repo.digest(path, key) == entry[1]:
+                    self.due_index[path] = entry = (key, entry[1], entry[2])
+            except OSError:
+                entry = None
+
+            if entry is None or entry[0] != key:
+                changed.add(path)
+            elif entry[2] <= now:
+                due.add(path)
+
+        changed |= self.due_index.keys() - versions.keys()
+        return changed, due
+
+    def build_catalogs(self, cache, previous, fresh=None):
+        """
+        Rebuilds the catalogs that changed between the previous and the current
+        parse cache. fresh is passed on to read_full_pkginfos.
+        """
+
+        if self.config.get("makecatalogs_bin") and isinstance(self.repo, LocalRepo):
+            self.logger.debug("Calling makecatalogs...")
             subprocess.call(  # noqa: S603
-                ["/usr/local/munki/makecatalogs", CONFIG["munki_repo"]],
+                [self.config["makecatalogs_bin"], self.config["munki_repo"]],
                 stdout=subprocess.DEVNULL,
             )
+            return
+
+        # Without a previous cache there is nothing to diff against, so rebuild everything
+        changed = None
+        if previous:
+            changed = {path for path, entry in cache.items() if previous.get(path) is not entry}
+            changed |= previous.keys() - cache.keys()
+        pkginfos = {path: entry[1] for path, entry in cache.items() if entry[1] is not None}
+        old = {path: previous[path][1] for path in changed or () if path in previous}
+        versions = {path: entry[0] for path, entry in cache.items()}
+        make_catalogs(self.repo, pkginfos, changed, old, partial(self.read_full_pkginfos, versions, fresh=fresh))
+
+    def forecast(self, days):
+        """Returns the promotions expected over the next days days, see PromotionEvaluator.forecast"""
+
+        # The parse cache is not updated here: the catalog builder diffs the
+        # next real run against the state the last real run left behind.
+        pkgs, _cache, _previous = self.read_repo()
+        return PromotionEvaluator(self).forecast(pkgs, days)
+
+    def apply(self, pkgs, cache, previous, evaluator=None):
+        """
+        Promotes pkgs, a list of (plist, path), then brings the parse cache,
+        catalogs and cache file up to date. cache must hold every pkginfo in
+        the repo, as the version index and catalogs are built from it.
+        evaluator defaults to a PromotionEvaluator at the current time.
+
+        Returns the promotions made and the paths written.
+        """
+
+        self.index = VersionIndex([(entry[1], path) for path, entry in cache.items() if entry[1] is not None])
+
+        # Let's do the promoting!
+        versions = {path: cache[path][0] for _plist, path in pkgs}
+        promotions, written = self.promote_pkgs(pkgs, self.index, evaluator or PromotionEvaluator(self), versions)
+
+        # Cache pkginfos we wrote as they now are in the repo, so neither this
+        # run's catalog builder nor the next run parses them again
+        fresh = {}
+        for path, (version, plist) in written.items():
+            fresh[path] = (version, normalize_plist(plist))
+            cache[path] = (version, PkgRecord.from_plist(fresh[path][1], self.record_keys))
+
+        if self.config.get("run_makecatalogs", True):
+            self.build_catalogs(cache, previous, fresh)
+
+        # Saved only once the catalogs are built, so a failed run is caught up on by the next
+        if self.config.get("parse_cache", True):
+            save_state(self.parse_cache_path(), PARSE_CACHE_VERSION, {"keys": self.record_keys, "pkginfos": cache})
+        self.parse_cache = cache
+
+        return promotions, set(written)
+
+    def run(self, notify=True):
+        """
+        Promotes every due package, then rebuilds the catalogs. Returns the promotions made.
+
+        With a due index from a previous run, only pkginfos that changed or
+        fell due since are read and evaluated; otherwise the whole repo is.
+        Unless notify is False (see run_repos), the Slack summary and results
+        file are produced as configured.
+        """
+
+        self.load_env()
+        self.logger.info("\n========================================\n")
+        promotions = {}
+        error = None
+        try:
+            use_index = self.config.get("due_index", True)
+            if self.due_index is None and use_index:
+                self.due_index = self.load_due_index()
+
+            if self.due_index is None:
+                # Parse every pkginfo that changed since the last run; safe_read_pkg
+                # returns None for clutter (eg .DS_Store), which read_pkgs drops.
+                pkgs, cache, previous = self.read_repo()
+                evaluator = PromotionEvaluator(self)
+                promotions, _written = self.apply(pkgs, cache, previous, evaluator)
+                if use_index:
+                    self.schedule(evaluated_at=evaluator.now.timestamp())
+                    self.save_due_index()
+            else:
+                changed, due = self.scan(time.time())
+                self.logger.info(f"{len(changed)} pkginfos changed and {len(due)} due since the last run")
+                if changed or due:
+                    promotions = self.process(changed, due)
+                elif self.config.get("run_makecatalogs", True) and self.indexed_catalogs - self.catalog_names():
+                    # Nothing to promote, but catalogs deleted since the last run still need rebuilding
+                    cache = self.load_parse_cache()
+                    self.build_catalogs(cache, cache)
+        except Exception as e:
+            self.logger.exception("Failed to promote packages")
+            error = e
+            raise
+        finally:
+            if notify:
+                self.report(promotions, error)
+
+        return promotions
+
+    def schedule(self, paths=None, evaluated_at=None):
+        """
+        Recomputes the due index entries of the pkginfos at paths (all of them
+        by default) from the parse cache. Packages that can never be promoted
+        under the current config are indexed as never due. So is anything
+        evaluated for promotion at evaluated_at (the evaluator's now), already
+        due then and still due afterwards, as promote_pkg refused it, until its
+        file changes. Packages falling due since stay scheduled.
+        """
+
+        evaluator = PromotionEvaluator(self)
+        # Due a second or more before evaluation counts as due then, as promote_pkg only counts whole seconds
+        refused_by = -inf if evaluated_at is None else evaluated_at - 1
+        old = self.due_index or {}
+        if paths is None:
+            self.due_index, self.due_heap = {}, []
+            paths = self.parse_cache.keys()
+
+        for path in paths:
+            entry = self.parse_cache.get(path)
+            if entry is None:
+                self.due_index.pop(path, None)
+                continue
+
+            due = evaluator.next_due(entry[1]) if entry[1] is not None else nan
+            if not due > refused_by:
+                due = nan
+            indexed = old.get(path)
+            try:
+                digest = indexed[1] if indexed and indexed[0] == entry[0] else self.repo.digest(path, entry[0])
+            except FileNotFoundError:
+                # Deleted since it was read; the next scan drops it from the parse cache
+                self.due_index.pop(path, None)
+                continue
+            self.due_index[path] = (entry[0], digest, due)
+            if not isnan(due):
+                heapq.heappush(self.due_heap, (due, path))
+
+    def rebuild_heap(self):
+        """Fills the daemon's heap of next promotion times from the due index, building it if need be"""
+
+        if self.due_index is None:
+            self.schedule()
+            return
+        self.due_heap = [(entry[2], path) for path, entry in self.due_index.items() if not isnan(entry[2])]
+        heapq.heapify(self.due_heap)
+
+    def pop_due(self, now):
+        """Removes and returns the paths of every package due for promotion at now"""
+
+        due = set()
+        while self.due_heap and self.due_heap[0][0] <= now:
+            timestamp, path = heapq.heappop(self.due_heap)
+            if (entry := self.due_index.get(path)) and entry[2] == timestamp:
+                due.add(path)
+        return due
+
+    def process(self, changed, due, rescan=False):
+        """
+        Re-reads the pkginfos at changed (or the whole repo, if rescan) and
+        promotes those that did change, along with the due ones.
+        """
+
+        previous = self.load_parse_cache()
+        if rescan or not previous:
+            # Catalogs and the version index need every pkginfo, so without a cache read them all
+            _pkgs, cache, _previous = self.read_repo()
+        else:
+            versions = {p: version for p in sorted(changed) if (version := self.repo.version(p)) is not None}
+            _pkgs, reread = read_pkgs(self.repo, versions, previous, self.config.get("parse_workers"), self.record_keys)
+            cache = {p: e for p, e in previous.items() if p not in changed}
+            cache.update(reread)
+
+        # Events for files we wrote ourselves come back with a matching stat, and drop out here
+        changed = {p for p in changed | cache.keys() | previous.keys() if cache.get(p) is not previous.get(p)}
+        paths = changed | due
+        if not paths:
+            return {}
+
+        pkgs = [(cache[p][1], p) for p in sorted(paths) if p in cache and cache[p][1] is not None]
+        evaluator = PromotionEvaluator(self)
+        promotions, written = self.apply(pkgs, cache, previous, evaluator)
+        self.schedule(paths | written, evaluator.now.timestamp())
+        if self.config.get("due_index", True):
+            self.save_due_index()
+        return promotions
+
+    def serve(self):
+        """
+        Runs as a resident daemon: one full run, then promotes packages the
+        moment they fall due (from a heap of next promotion times) and as soon
+        as pkginfos are added or changed (from inotify). Without inotify, as
+        for a repo in S3, the repo's pkginfos are checked every
+        daemon_poll_interval seconds.
+        """
+
+        self.load_env()
+        if self.config.get("notify_slack"):
+            self.start_flusher()
+            self._flush_wanted.set()  # send anything an earlier run left queued
+        self.run()
+        self.rebuild_heap()
+
+        local = isinstance(self.repo, LocalRepo)
+        watcher = InotifyWatcher(self.pkgsinfo) if local and InotifyWatcher.available() else None
+        poll = self.config.get("daemon_poll_interval", 300)
+        debounce = self.config.get("daemon_debounce", 2)
+        if watcher is None and local:
+            self.logger.warning(f"inotify is unavailable, checking {self.pkgsinfo} every {poll}s instead")
+        self.logger.info(f"Autopromote daemon watching {self.pkgsinfo}, {len(self.due_heap)} packages scheduled")
+
+        while True:
+            # One second late, as promote_pkg only counts whole seconds since last_promoted
+            timeout = max(0, self.due_heap[0][0] + 1 - time.time()) if self.due_heap else None
+            changed, rescan = set(), False
+            if watcher is None:
+                time.sleep(poll if timeout is None else min(timeout, poll))
+                rescan = True
+            elif watcher.wait(timeout):
+                time.sleep(debounce)  # let an import finish writing its pkginfos
+                changed, rescan = watcher.read()
+            changed = {p for p in changed if not os.path.basename(p).startswith(".")}
+
+            due = self.pop_due(time.time())
+            if not (changed or rescan or due):
+                continue
+
+            promotions, error = {}, None
+            try:
+                promotions = self.process(changed, due, rescan)
+            except Exception as e:
+                self.logger.exception("Failed to promote packages")
+                error = e
+            if promotions or error:
+                self.report(promotions, error)
+
+
+def repo_configs(config):
+    """
+    Splits a parsed autopromote.json listing several repos under "repos"
+    into one parsed config per repo. Each entry is a munki_repo path or a
+    dict of settings overriding the top-level ones. Repos are told apart by
+    their "name" (by default the munki_repo directory's name), which also
+    gives each its own subdirectory of cache_dir.
+    """
+
+    shared = {key: value for key, value in config.items() if key != "repos"}
+    configs = []
+    for repo in config["repos"]:
+        if isinstance(repo, str):
+            repo = {"munki_repo": repo}
+        repo_config = copy.deepcopy({**shared, **repo})
+        repo_config.setdefault("name", os.path.basename(os.path.normpath(repo_config["munki_repo"])))
+        if "cache_dir" not in repo:
+            repo_config["cache_dir"] = os.path.join(
+                shared.get("cache_dir", "~/.cache/autopromote"), repo_config["name"]
+            )
+        configs.append(repo_config)
+
+    names = [repo_config["name"] for repo_config in configs]
+    if len(set(names)) != len(names):
+        msg = f"repos must have distinct names, got {names}"
+        raise ValueError(msg)
+
+    # Leave the CPUs to the repos, rather than giving every repo a parse pool the size of the machine
+    for repo_config in configs:
+        repo_config.setdefault("parse_workers", max(1, (os.cpu_count() or 1) // len(configs)))
+    return configs
+
+
+def run_repo(config):
+    """
+    Runs one repo of run_repos in a worker process. Returns its promotions
+    and the error it failed with, if any, as a string.
+    """
+
+    try:
+        return AutoPromoter(config=config).run(notify=False), None
     except Exception as e:
-        logger.exception("Failed to promote packages")
-        error = e
-        raise
+        return {}, f"{e!r}"
+
+
+def repos_reporter(config, config_file=None):
+    """
+    Returns the AutoPromoter that reports for every repo of a parsed
+    multi-repo autopromote.json, read from config_file if given.
+    """
+
+    # Reports go where the top-level config sends them; any repo's catalog schedule will do
+    shared = {key: value for key, value in config.items() if key != "repos"}
+    return AutoPromoter(config_file, config=copy.deepcopy({**repo_configs(config)[0], **shared}))
+
+
+def run_repos(config, config_file=None):
+    """
+    Runs every repo of a parsed multi-repo autopromote.json (see repo_configs)
+    at once, one process each, then sends one Slack summary and writes one
+    results file for all of them (see repos_reporter). Returns the promotions made, keyed by repo
+    name and package. If any repo failed, raises once the others are done and
+    reported.
+    """
+
+    configs = repo_configs(config)
+    workers = config.get("repo_workers") or len(configs)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(run_repo, configs))
+
+    promotions, errors = {}, []
+    for repo_config, (repo_promotions, error) in zip(configs, results, strict=True):
+        name = repo_config["name"]
+        promotions.update({f"{name}: {fullname}": result for fullname, result in repo_promotions.items()})
+        if error:
+            errors.append(f"{name}: {error}")
+    error = "; ".join(errors) or None
+
+    reporter = repos_reporter(config, config_file)
+    reporter.load_env()
+    if error:
+        error = f"Failed to promote packages in {error}"
+        reporter.logger.error(error)
+    reporter.report(promotions, error)
+    if error:
+        raise RuntimeError(error)
+    return promotions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Promote munki pkginfos between catalogs as configured in CONFIG_FILE")
+    parser.add_argument(
+        "--forecast",
+        type=int,
+        metavar="DAYS",
+        help="Print the promotions expected over the next DAYS days instead of promoting anything",
+    )
+    parser.add_argument("--format", choices=["calendar", "json"], default="calendar", help="Forecast output format")
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Keep running, promoting packages as they fall due and as pkginfos change",
+    )
+    parser.add_argument(
+        "--flush-outbox",
+        action="store_true",
+        help="Send the queued Slack notifications and exit, as runs do in the background",
+    )
+    args = parser.parse_args()
+
+    with open(CONFIG_FILE) as f:
+        config = json.load(f)
+    repos = "repos" in config
+    if repos and (args.forecast is not None or args.daemon):
+        parser.error("--forecast and --daemon need a config with a single munki_repo")
+
+    promoter = repos_reporter(config, CONFIG_FILE) if repos else AutoPromoter(CONFIG_FILE, config=config)
+    if args.forecast is not None:
+        print(format_forecast(promoter.forecast(args.forecast), args.format))
+        return
+
+    try:
+        if args.flush_outbox:
+            promoter.flush_outbox()
+        elif args.daemon:
+            promoter.serve()
+        elif repos:
+            run_repos(config, CONFIG_FILE)
+        else:
+            promoter.run()
     finally:
-        if CONFIG.get("notify_slack"):
-            notify_slack(promotions, error)
-        if CONFIG.get("output_results"):
-            output_results(promotions, error)
         logging.shutdown()
 
 
@@ -3,13 +3,18 @@
 
 import argparse
 import csv
+import hashlib
 import logging
 import os
 import re
 import sys
+import tarfile
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from urllib.parse import unquote
+from urllib.parse import quote, unquote
 
 try:
     from github import Github, GithubException
@@ -22,12 +27,22 @@ sys.stdout.reconfigure(line_buffering=True)
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
 LOG_DIR = PROJECT_ROOT / 'logs'
 
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from lambopkg.tools.github_cache import GitHubCache  # noqa: E402
+from lambopkg.tools.rate_limit import get_tracker  # noqa: E402
+
 # Regex patterns for YAML and plist formats
 ID_PATTERN = re.compile(r'Identifier:\s*(\S+)|<key>Identifier</key>\s*<string>([^<]+)</string>')
 PARENT_PATTERN = re.compile(r'ParentRecipe:\s*(\S+)|<key>ParentRecipe</key>\s*<string>([^<]+)</string>')
+SHA_PATTERN = re.compile(r'^[0-9a-f]{40}$')
 PROC_PATTERN = re.compile(r'Processor:\s*com\.github\.([^.]+)\.([^/\s]+)/(\S+)|'
                           r'<key>Processor</key>\s*<string>com\.github\.([^.]+)\.([^/\s]+)/([^<]+)</string>')
 
+DEPENDENCY_WORKERS = 8  # concurrent lookups per level of the dependency graph
+_dependency_lock = threading.Lock()  # guards `processed` and `stats` across resolver threads
+
 RECIPE_TEMPLATE = """Description: Obtain upstream {app_name} recipe from {org}/{repo}
 
 Identifier: com.github.anywhereops.vendorer.{identifier_name}
@@ -89,6 +104,11 @@ def extract_match(pattern: re.Pattern, content: str) -> str | None:
     return None
 
 
+def git_blob_sha(data: bytes) -> str:
+    """SHA git assigns to a blob with this content (matches tree entry SHAs)."""
+    return hashlib.sha1(b'blob %d\0' % len(data) + data).hexdigest()  # noqa: S324
+
+
 def parse_github_url(url: str) -> dict | None:
     if not (m := re.match(r'https://github\.com/([^/]+)/([^/]+)/blob/([^/]+)/(.+)', url.strip())):
         return None
@@ -156,89 +176,243 @@ class GitHubAPI:
     Fetches the full repo tree once per repo (1 API call), then resolves
     all folder lookups, file listings, and path checks locally — dramatically
     reducing API usage compared to per-directory contents requests.
+
+    With a GitHubCache, trees, blobs and licenses are persisted on disk keyed by
+    commit/blob SHA and branch heads are revalidated with ETags, so later runs
+    only pay for what actually changed upstream.
+
+    Safe to share between threads: PyGithub's Requester reuses one connection
+    object and is not, so each thread gets its own client, and every cached
+    lookup is filled under a per-key lock so concurrent misses fetch once.
     """
 
-    def __init__(self, token: str | None = None):
-        self.gh = Github(auth=None) if not token else Github(login_or_token=token)
+    def __init__(self, token: str | None = None, cache: GitHubCache | None = None):
+        self.token = token
+        self.cache = cache
+        self.rate_limit = get_tracker(token)
+        self._local = threading.local()  # per-thread Github client and repo handles
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
         self._repo_cache: dict[str, 'github.Repository.Repository'] = {}
         self._tree_cache: dict[str, dict] = {}  # (org/repo, sha) -> parsed tree
         self._branch_cache: dict[str, str] = {}  # (org/repo) -> default branch
+        self._head_cache: dict[str, str | None] = {}  # (org/repo/branch) -> head sha
         self._license_cache: dict[str, str | None] = {}
+        self._index_cache: dict[str, dict | None] = {}  # (org/repo, sha) -> identifier index
+
+    @property
+    def gh(self) -> Github:
+        if (gh := getattr(self._local, 'gh', None)) is None:
+            gh = self._local.gh = Github(auth=None) if not self.token else Github(login_or_token=self.token)
+            self._local.repos = {}
+        return gh
 
     # ── helpers ──────────────────────────────────────────────
 
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(key, threading.Lock())
+
     def _repo(self, org: str, repo: str):
         key = f"{org}/{repo}"
+        gh = self.gh
         if key not in self._repo_cache:
-            try:
-                self._repo_cache[key] = self.gh.get_repo(key)
-            except GithubException as e:
-                log_print(f"  ❌ Repo not found: {key} ({e.data.get('message', '')})", 'error')
-                return None
-        return self._repo_cache[key]
+            with self._key_lock(f"repo:{key}"):
+                if key not in self._repo_cache:
+                    try:
+                        self._repo_cache[key] = self._local.repos[key] = gh.get_repo(key)
+                        self.rate_limit.update_from_client(gh)
+                    except GithubException as e:
+                        log_print(f"  ❌ Repo not found: {key} ({e.data.get('message', '')})", 'error')
+                        return None
+        # Repo objects are bound to the client that made them; other threads get a lazy handle (0 API calls)
+        if key not in self._local.repos:
+            self._local.repos[key] = gh.get_repo(key, lazy=True)
+        return self._local.repos[key]
+
+    def _branch_sha(self, org: str, repo: str, branch: str) -> str | None:
+        """Head SHA of a branch. Memoized per process and revalidated against the
+        on-disk ref with If-None-Match, so an unchanged branch costs a free 304."""
+        key = f"{org}/{repo}/{branch}"
+        if key not in self._head_cache:
+            with self._key_lock(f"head:{key}"):
+                if key not in self._head_cache:
+                    if not self._repo(org, repo):
+                        return None
+                    self._head_cache[key] = self._fetch_branch_sha(org, repo, branch)
+        return self._head_cache[key]
+
+    def _fetch_branch_sha(self, org: str, repo: str, branch: str) -> str | None:
+        r = self._repo(org, repo)
+
+        cached = self.cache.get_json('refs', org, repo, branch) if self.cache else None
+        headers = {'If-None-Match': cached['etag']} if cached and cached.get('etag') else None
+        try:
+            resp_headers, data = r._requester.requestJsonAndCheck(
+                'GET', f"{r.url}/branches/{quote(branch, safe='')}", headers=headers)
+        except GithubException:
+            return None
+        self.rate_limit.update_from_headers(resp_headers)
+
+        if not data and cached:  # 304 Not Modified
+            return cached['sha']
+        sha = data['commit']['sha']
+        if self.cache:
+            etag = {k.lower(): v for k, v in resp_headers.items()}.get('etag')
+            self.cache.put_json('refs', org, repo, branch, value={'sha': sha, 'etag': etag})
+        return sha
 
     def _resolve_branch(self, org: str, repo: str, preferred: str = 'main') -> str | None:
         """Resolve the default branch, trying preferred first then the fallback."""
         key = f"{org}/{repo}/{preferred}"
         if key in self._branch_cache:
             return self._branch_cache[key]
-        r = self._repo(org, repo)
-        if not r:
-            return None
         for branch in [preferred] + (['main'] if preferred == 'master' else ['master'] if preferred == 'main' else []):
-            try:
-                r.get_branch(branch)
+            if self._branch_sha(org, repo, branch):
                 self._branch_cache[key] = branch
                 return branch
-            except GithubException:
-                continue
         return None
 
+    @staticmethod
+    def _parse_tree(entries: list) -> dict:
+        """Build the lookup structure from [path, type, sha] tree entries."""
+        dirs = set()
+        files: dict[str, list[str]] = {}
+        all_paths = set()
+        blobs: dict[str, str] = {}
+
+        for path, item_type, sha in entries:
+            all_paths.add(path)
+            if item_type == 'tree':
+                dirs.add(path)
+            elif item_type == 'blob':
+                parent = str(Path(path).parent)
+                if parent == '.':
+                    parent = ''
+                files.setdefault(parent, []).append(Path(path).name)
+                blobs[path] = sha
+
+        return {'dirs': dirs, 'files': files, 'all_paths': all_paths, 'blobs': blobs}
+
     def _get_tree(self, org: str, repo: str, sha: str) -> dict:
         """Get full recursive tree for a repo at a given SHA. Returns parsed structure:
         {
             'dirs': set of directory paths,
             'files': dict mapping dir -> list of filenames,
             'all_paths': set of all file paths,
+            'blobs': dict mapping file path -> blob sha,
         }
-        Cached per (org/repo, sha).
+        Cached per (org/repo, sha), in memory and on disk.
         """
         cache_key = f"{org}/{repo}@{sha}"
-        if cache_key in self._tree_cache:
-            return self._tree_cache[cache_key]
+        if cache_key not in self._tree_cache:
+            with self._key_lock(f"tree:{cache_key}"):
+                if cache_key not in self._tree_cache:
+                    self._tree_cache[cache_key] = self._load_tree(org, repo, sha)
+        return self._tree_cache[cache_key]
+
+    def _load_tree(self, org: str, repo: str, sha: str) -> dict:
+        persistent = self.cache and SHA_PATTERN.match(sha)
+        if persistent and (entries := self.cache.get_json('trees', org, repo, sha)) is not None:
+            log_print(f"  🌳 Loaded tree for {org}/{repo} from disk cache (0 API calls)")
+            return self._parse_tree(entries)
 
         r = self._repo(org, repo)
         if not r:
-            empty = {'dirs': set(), 'files': {}, 'all_paths': set()}
-            self._tree_cache[cache_key] = empty
-            return empty
+            return self._parse_tree([])
 
         try:
             tree = r.get_git_tree(sha=sha, recursive=True)
+            self.rate_limit.update_from_client(self.gh)
         except GithubException as e:
             log_print(f"  ❌ Tree fetch failed for {org}/{repo}@{sha}: {e.data.get('message', '')}", 'error')
-            empty = {'dirs': set(), 'files': {}, 'all_paths': set()}
-            self._tree_cache[cache_key] = empty
-            return empty
+            return self._parse_tree([])
 
-        dirs = set()
-        files: dict[str, list[str]] = {}
-        all_paths = set()
+        entries = [[item.path, item.type, item.sha] for item in tree.tree]
+        if persistent:
+            self.cache.put_json('trees', org, repo, sha, value=entries)
+        result = self._parse_tree(entries)
+        log_print(f"  🌳 Cached tree for {org}/{repo}: {len(result['dirs'])} dirs, {len(result['all_paths'])} paths (1 API call)")
+        return result
 
-        for item in tree.tree:
-            all_paths.add(item.path)
-            if item.type == 'tree':
-                dirs.add(item.path)
-            elif item.type == 'blob':
-                parent = str(Path(item.path).parent)
-                if parent == '.':
-                    parent = ''
-                files.setdefault(parent, []).append(Path(item.path).name)
+    @staticmethod
+    def _parse_index(entries: dict) -> dict:
+        """Build identifier lookups from {path: [identifier, parent_identifier]} entries."""
+        by_path = {path: ident for path, (ident, _) in entries.items() if ident}
+        ids: dict[str, str] = {}
+        # Same precedence as scanning folders in order: a recipe directly inside
+        # a top-level folder wins over a nested one, then by folder, then by file
+        for path in sorted(by_path, key=lambda p: (p.count('/') != 1, p.split('/'))):
+            ids.setdefault(by_path[path], path)
+        return {'ids': ids, 'by_path': by_path}
+
+    def identifier_index(self, org: str, repo: str, sha: str) -> dict | None:
+        """Identifier index for every recipe in a repo at a SHA:
+        {
+            'ids': dict mapping Identifier -> path,
+            'by_path': dict mapping path -> Identifier,
+        }
+        Built lazily from one tarball download (1 API call for the archive link),
+        cached per (org/repo, sha) in memory and on disk. None if the archive
+        could not be read, in which case callers fall back to per-file fetches.
+        """
+        cache_key = f"{org}/{repo}@{sha}"
+        if cache_key not in self._index_cache:
+            with self._key_lock(f"index:{cache_key}"):
+                if cache_key not in self._index_cache:
+                    self._index_cache[cache_key] = self._load_index(org, repo, sha)
+        return self._index_cache[cache_key]
 
-        result = {'dirs': dirs, 'files': files, 'all_paths': all_paths}
-        self._tree_cache[cache_key] = result
-        log_print(f"  🌳 Cached tree for {org}/{repo}: {len(dirs)} dirs, {len(all_paths)} paths (1 API call)")
-        return result
+    def _load_index(self, org: str, repo: str, sha: str) -> dict | None:
+        persistent = self.cache and SHA_PATTERN.match(sha)
+        if persistent and (entries := self.cache.get_json('indexes', org, repo, sha)) is not None:
+            return self._parse_index(entries)
+
+        r = self._repo(org, repo)
+        if not r:
+            return None
+
+        entries = {}
+        try:
+            link = r.get_archive_link('tarball', ref=sha)
+            self.rate_limit.update_from_client(self.gh)
+            # Stream the archive; only recipe files are read, and each is also
+            # stored in the blob cache so later fetch_raw calls are free.
+            with urllib.request.urlopen(link, timeout=120) as resp, tarfile.open(fileobj=resp, mode='r|gz') as tar:  # noqa: S310
+                for member in tar:
+                    path = member.name.split('/', 1)[1] if '/' in member.name else ''
+                    if not member.isfile() or not path.endswith(('.recipe', '.recipe.yaml')):
+                        continue
+                    data = tar.extractfile(member).read()
+                    if self.cache:
+                        self.cache.put_blob(git_blob_sha(data), data)
+                    text = data.decode('utf-8', errors='replace')
+                    entries[path] = [extract_match(ID_PATTERN, text), extract_match(PARENT_PATTERN, text)]
+        except (GithubException, OSError, tarfile.TarError) as e:
+            log_print(f"  ⚠️  Could not index {org}/{repo}@{sha[:7]} from archive: {e}", 'warning')
+            return None
+
+        if persistent:
+            self.cache.put_json('indexes', org, repo, sha, value=entries)
+        log_print(f"  🗂️  Indexed {len(entries)} recipes in {org}/{repo} (1 API call)")
+        return self._parse_index(entries)
+
+    def recipe_identifier(self, org: str, repo: str, sha: str, path: str) -> str | None:
+        """Identifier declared by the recipe at path — an index hit when available."""
+        if (index := self.identifier_index(org, repo, sha)) is not None:
+            return index['by_path'].get(path)
+        content = self.fetch_raw(org, repo, sha, path)
+        return extract_match(ID_PATTERN, content) if content else None
+
+    def find_recipe_in_folder(self, org: str, repo: str, sha: str, folder: str, identifier: str) -> str | None:
+        """Filename of the recipe directly inside folder that declares identifier."""
+        for rf in self._recipe_files(self._get_tree(org, repo, sha), folder):
+            if self.recipe_identifier(org, repo, sha, f"{folder}/{rf}") == identifier:
+                return rf
+        return None
+
+    def _recipe_files(self, tree: dict, folder: str) -> list[str]:
+        return [f for f in self._files_in_dir(tree, folder) if f.endswith(('.recipe', '.recipe.yaml'))]
 
     def _top_level_dirs(self, tree: dict) -> list[str]:
         """Extract top-level directory names from a parsed tree."""
@@ -252,29 +426,33 @@ class GitHubAPI:
     # ── public API (same interface as before) ────────────────
 
     def fetch_raw(self, org: str, repo: str, ref: str, path: str) -> str | None:
-        """Fetch raw file content. Uses PyGithub get_contents (1 API call, but
-        content is base64-decoded automatically and cached by PyGithub)."""
+        """Fetch raw file content. Served from the blob cache when the tree for
+        ref is known (0 API calls), otherwise PyGithub get_contents (1 API call)."""
+        blob_sha = self._tree_cache.get(f"{org}/{repo}@{ref}", {}).get('blobs', {}).get(path)
+        if self.cache and blob_sha and (data := self.cache.get_blob(blob_sha)) is not None:
+            return data.decode('utf-8')
         r = self._repo(org, repo)
         if not r:
             return None
         try:
             content = r.get_contents(path, ref=ref)
+            self.rate_limit.update_from_client(self.gh)
             if isinstance(content, list):
                 return None  # it's a directory, not a file
-            return content.decoded_content.decode('utf-8')
+            data = content.decoded_content
+            if self.cache:
+                self.cache.put_blob(content.sha, data)
+            return data.decode('utf-8')
         except GithubException:
             return None
 
     def get_commit(self, org: str, repo: str, branch: str, path: str) -> str | None:
         """Get latest commit SHA on branch, verifying path exists via cached tree."""
-        r = self._repo(org, repo)
-        if not r:
+        if not self._repo(org, repo):
             return None
         branches = [branch] + (['main'] if branch == 'master' else ['master'] if branch == 'main' else [])
         for b in branches:
-            try:
-                sha = r.get_branch(b).commit.sha
-            except GithubException:
+            if not (sha := self._branch_sha(org, repo, b)):
                 continue
             tree = self._get_tree(org, repo, sha)
             # Check if path exists as a directory or file in the tree
@@ -287,17 +465,23 @@ class GitHubAPI:
         key = f"{org}/{repo}"
         if key in self._license_cache:
             return self._license_cache[key]
+        persistent = self.cache and ref and SHA_PATTERN.match(ref)
+        if persistent and (cached := self.cache.get_json('licenses', org, repo, ref)) is not None:
+            self._license_cache[key] = cached.get('spdx')
+            return self._license_cache[key]
         r = self._repo(org, repo)
         if not r:
             return None
         try:
             lic = r.get_license()
+            self.rate_limit.update_from_client(self.gh)
             spdx = lic.license.spdx_id if lic and lic.license else None
-            self._license_cache[key] = spdx
-            return spdx
         except GithubException:
-            self._license_cache[key] = None
-            return None
+            spdx = None
+        self._license_cache[key] = spdx
+        if persistent:
+            self.cache.put_json('licenses', org, repo, ref, value={'spdx': spdx})
+        return spdx
 
     def path_exists(self, org: str, repo: str, sha: str, path: str) -> bool:
         """Check if a path exists in the cached tree (0 API calls)."""
@@ -321,15 +505,12 @@ class GitHubAPI:
     def find_folder(self, org: str, repo: str, app_name: str, target_id: str | None = None,
                     is_processor: bool = False, processor_name: str | None = None) -> str | None:
         """Find folder using cached tree — typically 0 extra API calls.
-        Falls back to fetching raw content only for identifier-based search."""
-        r = self._repo(org, repo)
-        if not r:
+        Falls back to the repo's identifier index (1 API call) for identifier-based search."""
+        if not self._repo(org, repo):
             return None
 
         for branch_name in ['main', 'master']:
-            try:
-                sha = r.get_branch(branch_name).commit.sha
-            except GithubException:
+            if not (sha := self._branch_sha(org, repo, branch_name)):
                 continue
 
             tree = self._get_tree(org, repo, sha)
@@ -384,13 +565,18 @@ class GitHubAPI:
                             return folder
             else:
                 log_print(f"  🔎 No quick match, searching {len(dirs)} folders by identifier: {target_id or app_name}")
-                for i, folder in enumerate(dirs, 1):
-                    log_print(f"    [{i}/{len(dirs)}] Checking {folder}...")
-                    recipe_files = [f for f in self._files_in_dir(tree, folder)
-                                    if f.endswith(('.recipe', '.recipe.yaml'))]
-                    for rf in recipe_files:
-                        if content := self.fetch_raw(org, repo, sha, f"{folder}/{rf}"):
-                            if found_id := extract_match(ID_PATTERN, content):
+                index = self.identifier_index(org, repo, sha)
+                if target_id and index is not None:
+                    path = index['ids'].get(target_id, '')
+                    if '/' in path and (folder := path.split('/')[0]) in dirs:
+                        log_print(f"  ✓ Found by identifier in folder: {folder}")
+                        return folder
+                else:
+                    for i, folder in enumerate(dirs, 1):
+                        if index is None:
+                            log_print(f"    [{i}/{len(dirs)}] Checking {folder}...")
+                        for rf in self._recipe_files(tree, folder):
+                            if found_id := self.recipe_identifier(org, repo, sha, f"{folder}/{rf}"):
                                 if target_id and found_id == target_id:
                                     log_print(f"  ✓ Found by identifier in folder: {folder}")
                                     return folder
@@ -412,15 +598,9 @@ class GitHubAPI:
         return list({(m[0] or m[3], m[1] or m[4], m[2] or m[5]) for m in PROC_PATTERN.findall(content)})
 
     def get_rate_limit(self) -> dict:
-        """Get current rate limit status."""
-        rate = self.gh.get_rate_limit().core
-        return {
-            'limit': rate.limit,
-            'remaining': rate.remaining,
-            'used': rate.limit - rate.remaining,
-            'reset': int(rate.reset.timestamp()),
-            'authenticated': bool(self.gh.auth),
-        }
+        """Get current rate limit status from the shared tracker (0 API calls unless stale)."""
+        self.rate_limit.update_from_client(self.gh)
+        return self.rate_limit.status()
 
 
 def find_dependency(api: GitHubAPI, dep_type: str, dep_author: str, dep_folder: str,
@@ -444,12 +624,7 @@ def find_dependency(api: GitHubAPI, dep_type: str, dep_author: str, dep_folder:
         branch = api._resolve_branch(org, repo)
         if not branch:
             return None
-        r = api._repo(org, repo)
-        if not r:
-            return None
-        try:
-            sha = r.get_branch(branch).commit.sha
-        except GithubException:
+        if not (sha := api._branch_sha(org, repo, branch)):
             return None
 
         if is_processor:
@@ -460,15 +635,10 @@ def find_dependency(api: GitHubAPI, dep_type: str, dep_author: str, dep_folder:
             if folder := api.find_folder(org, repo, dep_folder, is_processor=True, processor_name=processor_name):
                 return (org, repo, folder)
         elif same_author and org == source_org:
-            # Check same folder first for recipes in same repo (tree cached)
-            tree = api._get_tree(org, repo, sha)
-            recipe_files = [f for f in api._files_in_dir(tree, source_folder)
-                            if f.endswith(('.recipe', '.recipe.yaml'))]
-            for rf in recipe_files:
-                if content := api.fetch_raw(org, repo, sha, f"{source_folder}/{rf}"):
-                    if extract_match(ID_PATTERN, content) == parent_id:
-                        log_print(f"  ✓ Found parent in same folder: {source_folder}")
-                        return (org, repo, source_folder)
+            # Check same folder first for recipes in same repo (identifier index, 0-1 API calls)
+            if api.find_recipe_in_folder(org, repo, sha, source_folder, parent_id):
+                log_print(f"  ✓ Found parent in same folder: {source_folder}")
+                return (org, repo, source_folder)
             log_print(f"  → Parent not in same folder, searching repo...")
         if not is_processor and (folder := api.find_folder(org, repo, dep_folder, parent_id)):
             return (org, repo, folder)
@@ -500,8 +670,11 @@ def fetch_dependency(api: GitHubAPI, dep_type: str, org: str, repo: str, folder:
         target_parent_id: The specific parent identifier we're looking for. If provided,
                           we search for the recipe file that matches this identifier.
     """
-    if (key := (org, repo, folder, dep_type)) in processed:
-        return None
+    # Claim the key up front so concurrent resolvers never fetch the same dependency twice
+    with _dependency_lock:
+        if (key := (org, repo, folder, dep_type)) in processed:
+            return None
+        processed.add(key)
 
     maintainer = get_maintainer(None, repo)
     skip_write = current_maintainer and current_maintainer.lower() == maintainer.lower()
@@ -512,31 +685,23 @@ def fetch_dependency(api: GitHubAPI, dep_type: str, org: str, repo: str, folder:
     log_print(f"  📦 Fetching {dep_type}: {org}/{repo}/{folder}")
 
     if not (commit := api.get_commit(org, repo, 'main', folder)):
+        # Nothing was vendored, so give the key back for a later reference to retry
+        with _dependency_lock:
+            processed.discard(key)
         stats['errors'].append(f"{dep_type.title()} not found: {org}/{repo} -> {folder}")
         return None
 
     recipe_content = None
-    if not is_processor:
-        tree = api._get_tree(org, repo, commit)
-        recipe_files = [f for f in api._files_in_dir(tree, folder)
-                        if f.endswith(('.recipe', '.recipe.yaml'))]
-
-        if target_parent_id and recipe_files:
+    if not is_processor and (recipe_files := api._recipe_files(api._get_tree(org, repo, commit), folder)):
+        # Fallback (no target ID, or not found by ID): use first recipe
+        recipe_file = recipe_files[0]
+        if target_parent_id and len(recipe_files) > 1:
             # Search for the specific recipe matching target_parent_id
-            for recipe_file in recipe_files:
-                content = api.fetch_raw(org, repo, commit, f"{folder}/{recipe_file}")
-                if content and extract_match(ID_PATTERN, content) == target_parent_id:
-                    recipe_content = content
-                    log_print(f"  ✓ Found matching recipe: {recipe_file}")
-                    break
-            # Fallback: if not found by ID, use first recipe
-            if not recipe_content and recipe_files:
-                recipe_content = api.fetch_raw(org, repo, commit, f"{folder}/{recipe_files[0]}")
-        elif recipe_files:
-            # No target ID specified, use first recipe
-            recipe_content = api.fetch_raw(org, repo, commit, f"{folder}/{recipe_files[0]}")
-
-    processed.add(key)
+            if match := api.find_recipe_in_folder(org, repo, commit, folder, target_parent_id):
+                recipe_file = match
+                log_print(f"  ✓ Found matching recipe: {recipe_file}")
+        recipe_content = api.fetch_raw(org, repo, commit, f"{folder}/{recipe_file}")
+
     if skip_write:
         return recipe_content
 
@@ -546,61 +711,88 @@ def fetch_dependency(api: GitHubAPI, dep_type: str, org: str, repo: str, folder:
     (output_dir / filename).write_text(generate_recipe(ctx, commit, api.get_license(org, repo, commit),
                                                         PROCESSOR_TEMPLATE if is_processor else RECIPE_TEMPLATE))
     log_print(f"✅ {filename}")
-    stats['generated'] += 1
-    stats['filenames'].append(filename)
+    with _dependency_lock:
+        stats['generated'] += 1
+        stats['filenames'].append(filename)
     return recipe_content
 
 
+def resolve_parent(api: GitHubAPI, node: tuple, output_dir: Path, processed: set, stats: dict) -> tuple | None:
+    """Locate and vendor the parent recipe of node. Returns the parent as a new node, or None."""
+    content, current_id, current_maintainer, source_org, source_repo, source_folder = node
+    parent_id = extract_match(PARENT_PATTERN, content)
+    log_print(f"  🔍 Found parent: {parent_id}")
+    parent = parse_identifier(parent_id)
+
+    if parent:
+        # Standard com.github.* identifier - use normal dependency resolution
+        location = find_dependency(api, 'recipe', parent['author'], parent['app_name'],
+                                   current_id, source_org, source_repo, source_folder, parent_id)
+        maintainer = strip_recipes_suffix(parent['author'])
+    else:
+        # Non-standard identifier (e.g., com.amazon.aws.*) - search same folder first
+        log_print(f"  → Non-standard identifier, checking same folder: {source_folder}")
+        location = (source_org, source_repo, source_folder)
+        maintainer = current_maintainer
+
+    if not location:
+        stats['errors'].append(f"Parent not found: {parent_id}")
+        return None
+    org, repo, folder = location
+    if parent_content := fetch_dependency(api, 'recipe', org, repo, folder, output_dir,
+                                          processed, stats, current_maintainer, parent_id):
+        return (parent_content, parent_id, maintainer, org, repo, folder)
+    return None
+
+
+def resolve_processor(api: GitHubAPI, node: tuple, proc: tuple[str, str, str], output_dir: Path,
+                      processed: set, stats: dict) -> tuple | None:
+    """Locate and vendor one external processor of node. Returns it as a new node, or None."""
+    _, current_id, _, source_org, source_repo, source_folder = node
+    author, folder_hint, proc_name = proc
+    log_print(f"  🔧 Found processor: {author}.{folder_hint}/{proc_name}")
+    if location := find_dependency(api, 'processor', author, folder_hint,
+                                   current_id, source_org, source_repo, source_folder,
+                                   processor_name=proc_name):
+        org, repo, folder = location
+        if proc_content := fetch_dependency(api, 'processor', org, repo, folder,
+                                            output_dir, processed, stats):
+            return (proc_content, None, author, org, repo, folder)
+    return None
+
+
 def fetch_dependencies_recursive(api: GitHubAPI, content: str, current_id: str | None,
                                   current_maintainer: str, output_dir: Path, processed: set, stats: dict,
-                                  source_org: str, source_repo: str, source_folder: str) -> None:
-    """Recursively fetch parent recipes and external processors."""
-    # Handle parent recipe
-    if parent_id := extract_match(PARENT_PATTERN, content):
-        log_print(f"  🔍 Found parent: {parent_id}")
-        parent = parse_identifier(parent_id)
-
-        if parent:
-            # Standard com.github.* identifier - use normal dependency resolution
-            location = find_dependency(api, 'recipe', parent['author'], parent['app_name'],
-                                       current_id, source_org, source_repo, source_folder, parent_id)
-            maintainer = strip_recipes_suffix(parent['author'])
-        else:
-            # Non-standard identifier (e.g., com.amazon.aws.*) - search same folder first
-            log_print(f"  → Non-standard identifier, checking same folder: {source_folder}")
-            location = (source_org, source_repo, source_folder)
-            maintainer = current_maintainer
-
-        if location:
-            org, repo, folder = location
-            if parent_content := fetch_dependency(api, 'recipe', org, repo, folder, output_dir,
-                                                   processed, stats, current_maintainer, parent_id):
-                fetch_dependencies_recursive(api, parent_content, parent_id, maintainer,
-                                             output_dir, processed, stats, org, repo, folder)
-        else:
-            stats['errors'].append(f"Parent not found: {parent_id}")
-
-    # Handle external processors
-    for author, folder_hint, proc_name in api.get_external_processors(content):
-        log_print(f"  🔧 Found processor: {author}.{folder_hint}/{proc_name}")
-        if location := find_dependency(api, 'processor', author, folder_hint,
-                                       current_id, source_org, source_repo, source_folder,
-                                       processor_name=proc_name):
-            org, repo, folder = location
-            if proc_content := fetch_dependency(api, 'processor', org, repo, folder,
-                                                output_dir, processed, stats):
-                fetch_dependencies_recursive(api, proc_content, None, author, output_dir, processed, stats,
-                                             org, repo, folder)
-
-
-def process_urls(urls: list[str]) -> dict:
-    log_print(f"Starting generation for {len(urls)} URLs...")
+                                  source_org: str, source_repo: str, source_folder: str,
+                                  jobs: int = DEPENDENCY_WORKERS) -> None:
+    """Fetch parent recipes and external processors, breadth-first.
 
-    token = os.environ.get('GITHUB_TOKEN')
-    if not token:
-        log_print("⚠️  No GITHUB_TOKEN env var - rate limits apply", 'warning')
+    Each level of the graph (a recipe's parent plus its processors, across every
+    node found at the previous level) is resolved concurrently on a bounded pool.
+    """
+    frontier = [(content, current_id, current_maintainer, source_org, source_repo, source_folder)]
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        while frontier:
+            futures = []
+            for node in frontier:
+                if extract_match(PARENT_PATTERN, node[0]):
+                    futures.append(pool.submit(resolve_parent, api, node, output_dir, processed, stats))
+                for proc in api.get_external_processors(node[0]):
+                    futures.append(pool.submit(resolve_processor, api, node, proc, output_dir, processed, stats))
+            frontier = [child for f in futures if (child := f.result())]
+
+
+def process_urls(urls: list[str], use_cache: bool = True, api: GitHubAPI | None = None,
+                 jobs: int = DEPENDENCY_WORKERS) -> dict:
+    """Generate vendor recipes for urls. Pass a shared api to reuse its caches across calls."""
+    log_print(f"Starting generation for {len(urls)} URLs...")
 
-    api = GitHubAPI(token)
+    owns_api = api is None
+    if owns_api:
+        token = os.environ.get('GITHUB_TOKEN')
+        if not token:
+            log_print("⚠️  No GITHUB_TOKEN env var - rate limits apply", 'warning')
+        api = GitHubAPI(token, GitHubCache() if use_cache else None)
     output_dir = PROJECT_ROOT / 'AutoPkg/Vendorer'
     processed, stats = set(), {'generated': 0, 'skipped': 0, 'errors': [], 'identifiers': [], 'filenames': [], 'recipes': []}
 
@@ -644,7 +836,7 @@ def process_urls(urls: list[str]) -> dict:
 
         if content:
             fetch_dependencies_recursive(api, content, main_identifier, maintainer, output_dir, processed, stats,
-                                          ctx['org'], ctx['repo'], ctx['folder_path'])
+                                          ctx['org'], ctx['repo'], ctx['folder_path'], jobs)
 
     log_print(f"\n📊 Generated: {stats['generated']}, Skipped: {stats['skipped']}, Errors: {len(stats['errors'])}")
     if stats['identifiers']:
@@ -653,6 +845,8 @@ def process_urls(urls: list[str]) -> dict:
         log_print(f"📁 Filenames: {', '.join(stats['filenames'])}")
     if stats['errors']:
         log_print(f"\n{'='*60}\n❌ ERRORS ({len(stats['errors'])}):\n" + '\n'.join(f"  • {e}" for e in stats['errors']) + f"\n{'='*60}", 'error')
+    if owns_api and api.cache:
+        api.cache.prune()
     return stats
 
 
@@ -660,6 +854,9 @@ def main():
     p = argparse.ArgumentParser(description='Generate AutoPkg vendor recipes')
     p.add_argument('urls', nargs='*', help='GitHub recipe URLs')
     p.add_argument('--csv', help='CSV file with recipe URLs')
+    p.add_argument('--no-cache', action='store_true', help='Disable the on-disk GitHub cache')
+    p.add_argument('--jobs', '-j', type=int, default=DEPENDENCY_WORKERS,
+                   help='Concurrent GitHub lookups while resolving dependencies')
     args = p.parse_args()
 
     urls = list(args.urls)
@@ -675,7 +872,7 @@ def main():
         sys.exit("❌ No URLs provided")
 
     log_file = setup_logging()
-    stats = process_urls(urls)
+    stats = process_urls(urls, use_cache=not args.no_cache, jobs=args.jobs)
 
     if stats['identifiers']:
         log_print(f"IDENTIFIERS:{','.join(stats['identifiers'])}")
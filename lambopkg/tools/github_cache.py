@@ -0,0 +1,119 @@
+"""Persistent on-disk cache for GitHub trees, blobs and branch heads."""
+
+import contextlib
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+from urllib.parse import quote
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
+DEFAULT_CACHE_DIR = PROJECT_ROOT / ".cache" / "github"
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+DEFAULT_MAX_AGE = 30 * 24 * 60 * 60
+
+
+class GitHubCache:
+    """Content-addressed cache shared by every process that talks to GitHub.
+
+    Layout under ``root``:
+        trees/<org>/<repo>/<sha>.json     parsed recursive tree (immutable)
+        blobs/<sha[:2]>/<sha>             raw file contents keyed by blob SHA (immutable)
+        refs/<org>/<repo>/<branch>.json   last known head SHA + ETag (revalidated)
+        licenses/<org>/<repo>/<sha>.json  SPDX id at a commit (immutable)
+
+    Immutable entries never need revalidation; refs are refreshed with
+    conditional requests, which GitHub does not count against the rate limit
+    when they come back 304. Entries are evicted by age and total size.
+    """
+
+    def __init__(self, root: Path | str | None = None, max_bytes: int | None = None, max_age: int | None = None):
+        self.root = Path(root or os.environ.get("LAMBOPKG_CACHE_DIR") or DEFAULT_CACHE_DIR).expanduser()
+        self.max_bytes = (
+            max_bytes
+            if max_bytes is not None
+            else int(float(os.environ.get("LAMBOPKG_CACHE_MAX_MB", DEFAULT_MAX_BYTES / 1024 / 1024)) * 1024 * 1024)
+        )
+        self.max_age = (
+            max_age
+            if max_age is not None
+            else int(float(os.environ.get("LAMBOPKG_CACHE_MAX_AGE_DAYS", DEFAULT_MAX_AGE / 86400)) * 86400)
+        )
+
+    # ── helpers ──────────────────────────────────────────────
+
+    def _path(self, kind: str, *parts: str, suffix: str = ".json") -> Path:
+        safe = [quote(p, safe="") for p in parts]
+        return self.root / kind / Path(*safe[:-1]) / f"{safe[-1]}{suffix}"
+
+    def _read(self, path: Path) -> bytes | None:
+        try:
+            data = path.read_bytes()
+        except OSError:
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(path)  # bump mtime so eviction is least-recently-used
+        return data
+
+    def _write(self, path: Path, data: bytes) -> None:
+        """Write atomically so concurrent processes never see a partial entry."""
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"Cache write failed for {path}: {e}")
+
+    # ── public API ───────────────────────────────────────────
+
+    def get_json(self, kind: str, *parts: str):
+        if (data := self._read(self._path(kind, *parts))) is None:
+            return None
+        try:
+            return json.loads(data)
+        except ValueError:
+            return None
+
+    def put_json(self, kind: str, *parts: str, value) -> None:
+        self._write(self._path(kind, *parts), json.dumps(value).encode("utf-8"))
+
+    def get_blob(self, sha: str) -> bytes | None:
+        return self._read(self._path("blobs", sha[:2], sha, suffix=""))
+
+    def put_blob(self, sha: str, data: bytes) -> None:
+        self._write(self._path("blobs", sha[:2], sha, suffix=""), data)
+
+    def prune(self) -> tuple[int, int]:
+        """Evict entries older than max_age, then oldest-first until under max_bytes.
+        Returns (files_removed, bytes_removed)."""
+        if not self.root.exists():
+            return 0, 0
+        now = time.time()
+        entries = []
+        for path in self.root.rglob("*"):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if path.is_file():
+                entries.append((st.st_mtime, st.st_size, path))
+
+        removed = freed = 0
+        total = sum(size for _, size, _ in entries)
+        for mtime, size, path in sorted(entries, key=lambda e: e[0]):
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            removed += 1
+            freed += size
+            total -= size
+        if removed:
+            logging.info(f"Pruned {removed} cache entries ({freed} bytes) from {self.root}")
+        return removed, freed
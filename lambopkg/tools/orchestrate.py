@@ -13,6 +13,8 @@ from pathlib import Path
 TOOLS_DIR = Path(__file__).resolve().parent
 PROJECT_ROOT = TOOLS_DIR.parent.parent
 LOG_DIR = PROJECT_ROOT / 'logs'
+VENDORER_DIR = PROJECT_ROOT / 'AutoPkg/Vendorer'
+RECIPE_REPOS = PROJECT_ROOT / 'AutoPkg/Recipes'
 
 
 def _find_python() -> str:
@@ -67,12 +69,25 @@ def setup():
     logging.info("Configured autopkg directories")
 
 
-def run_script(name: str, args: list[str]) -> tuple[int, list[str]]:
-    """Run script, stream output, return (returncode, output_lines)."""
-    cmd = [_find_python(), str(TOOLS_DIR / f'{name}.py')] + args
+def _load_tools():
+    """Import generate/run/override as libraries. Deferred so subprocess mode
+    doesn't need their dependencies in the orchestrating interpreter."""
+    if str(PROJECT_ROOT) not in sys.path:
+        sys.path.insert(0, str(PROJECT_ROOT))
+    from lambopkg.tools import generate, override, run
+    return generate, run, override
+
+
+def print_stage(name: str, args: list[str]) -> None:
     header = f"\n{'='*60}\n[{name.upper()}] {' '.join(args[:3])}{'...' if len(args) > 3 else ''}\n{'='*60}"
     print(header)
     logging.info(header)
+
+
+def run_script(name: str, args: list[str]) -> tuple[int, list[str]]:
+    """Run script, stream output, return (returncode, output_lines)."""
+    cmd = [_find_python(), str(TOOLS_DIR / f'{name}.py')] + args
+    print_stage(name, args)
     proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
     lines = []
     for line in proc.stdout:
@@ -91,14 +106,14 @@ def parse_output(lines: list[str], prefix: str) -> list[str]:
     return []
 
 
-def process_url(url: str, dry_run: bool = False, force: bool = False) -> bool:
+def process_url(url: str, dry_run: bool = False, force: bool = False, no_cache: bool = False) -> bool:
     """Process single URL: generate -> run -> override. Returns success."""
     header = f"\n{'#'*60}\nProcessing: {url}\n{'#'*60}"
     print(header)
     logging.info(header)
 
     # Generate vendor recipes
-    ret, lines = run_script('generate', [url])
+    ret, lines = run_script('generate', [url, '--no-cache'] if no_cache else [url])
     if ret != 0:
         print(f"❌ Generate failed for {url}")
         logging.error(f"Generate failed for {url}")
@@ -143,12 +158,66 @@ def process_url(url: str, dry_run: bool = False, force: bool = False) -> bool:
     return True
 
 
+def process_url_inline(url: str, api, dry_run: bool = False, force: bool = False) -> bool:
+    """Same pipeline as process_url, but every stage runs in this interpreter
+    against the shared api and hands its structured results to the next."""
+    generate, run, override = _load_tools()
+    header = f"\n{'#'*60}\nProcessing: {url}\n{'#'*60}"
+    print(header)
+    logging.info(header)
+
+    # Generate vendor recipes
+    print_stage('generate', [url])
+    try:
+        stats = generate.process_urls([url], api=api)
+    except Exception:
+        print(f"❌ Generate failed for {url}")
+        logging.exception(f"Generate failed for {url}")
+        return False
+
+    if not (filenames := stats['filenames']):
+        print(f"⚠️  No vendor recipes generated for {url}")
+        logging.warning(f"No vendor recipes generated for {url}")
+        return False
+
+    # Run each vendor recipe (autopkg resolves relative paths from the recipe repos dir)
+    print_stage('run', filenames)
+    original_dir = os.getcwd()
+    os.chdir(RECIPE_REPOS)
+    try:
+        _, failed = run.run_recipes([str(VENDORER_DIR / f) for f in filenames], dry_run,
+                                    github_token=run.get_github_token())
+    finally:
+        os.chdir(original_dir)
+    if failed:
+        print(f"⚠️  Run had failures for {url}")
+        logging.warning(f"Run had failures for {url}")
+
+    # Create overrides using actual recipe names
+    if not (recipes := stats['recipes']):
+        print(f"⚠️  No recipe names found for {url}")
+        logging.warning(f"No recipe names found for {url}")
+        return True  # Still consider success if vendor ran
+
+    print_stage('override', recipes)
+    if override.create_overrides(recipes, dry_run, force)['failures']:
+        print(f"⚠️  Override had failures for {url}")
+        logging.warning(f"Override had failures for {url}")
+
+    print(f"✅ Completed: {url}")
+    logging.info(f"Completed: {url}")
+    return True
+
+
 def main():
     p = argparse.ArgumentParser(description='Orchestrate autopkg vendor workflow')
     p.add_argument('url', nargs='?', help='GitHub recipe URL')
     p.add_argument('--csv', help='CSV file with URLs (column: Autopkg Recipe)')
     p.add_argument('-n', '--dry-run', action='store_true')
     p.add_argument('-f', '--force', action='store_true')
+    p.add_argument('--batch', action='store_true',
+                   help='Run every stage in-process with one shared GitHub client instead of subprocesses')
+    p.add_argument('--no-cache', action='store_true', help='Disable the on-disk GitHub cache')
     args = p.parse_args()
 
     if not args.url and not args.csv:
@@ -165,13 +234,26 @@ def main():
             reader = csv.DictReader(f)
             urls.extend(row.get('Autopkg Recipe', '').strip() for row in reader if row.get('Autopkg Recipe', '').strip())
 
+    api = None
+    if args.batch:
+        generate, _, _ = _load_tools()
+        token = os.environ.get('GITHUB_TOKEN')
+        if not token:
+            generate.log_print("⚠️  No GITHUB_TOKEN env var - rate limits apply", 'warning')
+        api = generate.GitHubAPI(token, None if args.no_cache else generate.GitHubCache())
+
     succeeded = failed = 0
     for url in urls:
-        if process_url(url, args.dry_run, args.force):
+        ok = process_url_inline(url, api, args.dry_run, args.force) if api else \
+            process_url(url, args.dry_run, args.force, args.no_cache)
+        if ok:
             succeeded += 1
         else:
             failed += 1
 
+    if api and api.cache:
+        api.cache.prune()
+
     summary = f"\n{'='*60}\nComplete: {succeeded} succeeded, {failed} failed\n{'='*60}"
     print(summary)
     logging.info(summary)
@@ -117,41 +117,9 @@ def create_override(identifier: str, force: bool = False) -> tuple[str, str | No
     return 'failed', error
 
 
-def main():
-    p = argparse.ArgumentParser(description='Create overrides for AutoPkg recipes')
-    p.add_argument('-n', '--dry-run', action='store_true')
-    p.add_argument('-f', '--force', action='store_true')
-    p.add_argument('--identifier', action='append', dest='identifiers',
-                   help='Specific recipe identifier(s) to override')
-    p.add_argument('--filenames', help='Comma-separated vendor recipe filenames from generate.py')
-    args = p.parse_args()
-
-    log_file = setup_logging()
-
-    # Get recipes to process
-    if args.filenames:
-        recipes = []
-        for f in args.filenames.split(','):
-            if recipe := get_recipe_from_vendor(f.strip()):
-                recipes.append(recipe)
-        if not recipes:
-            print("No recipes found from vendor files")
-            logging.info("No recipes found from vendor files")
-            return
-    elif args.identifiers:
-        # Accept all recipe types passed via identifiers
-        recipes = list(args.identifiers)
-        if not recipes:
-            print("No recipes to override")
-            logging.info("No recipes to override")
-            return
-    else:
-        if not RECIPE_REPOS.exists():
-            sys.exit(f"Error: {RECIPE_REPOS} not found")
-        recipes = find_munki_recipes()
-        if not recipes:
-            sys.exit("No munki recipes found")
-
+def create_overrides(recipes: list[str], dry_run: bool = False, force: bool = False) -> dict:
+    """Create overrides for each identifier and print a summary.
+    Returns {'created': int, 'existing': [...], 'failures': [...]}."""
     print(f"Processing {len(recipes)} recipe(s)\n")
     logging.info(f"Processing {len(recipes)} recipe(s)")
 
@@ -161,13 +129,13 @@ def main():
     failures = []
 
     for identifier in recipes:
-        if args.dry_run:
+        if dry_run:
             print(f"  {identifier}")
             logging.info(f"[dry-run] {identifier}")
             created += 1
             continue
 
-        status, error = create_override(identifier, args.force)
+        status, error = create_override(identifier, force)
 
         if status == 'created':
             print(f"✅ {identifier}")
@@ -191,6 +159,45 @@ def main():
     if failures:
         print(f"Failed: {', '.join(failures)}")
         logging.error(f"Failed: {', '.join(failures)}")
+    return {'created': created, 'existing': existing, 'failures': failures}
+
+
+def main():
+    p = argparse.ArgumentParser(description='Create overrides for AutoPkg recipes')
+    p.add_argument('-n', '--dry-run', action='store_true')
+    p.add_argument('-f', '--force', action='store_true')
+    p.add_argument('--identifier', action='append', dest='identifiers',
+                   help='Specific recipe identifier(s) to override')
+    p.add_argument('--filenames', help='Comma-separated vendor recipe filenames from generate.py')
+    args = p.parse_args()
+
+    log_file = setup_logging()
+
+    # Get recipes to process
+    if args.filenames:
+        recipes = []
+        for f in args.filenames.split(','):
+            if recipe := get_recipe_from_vendor(f.strip()):
+                recipes.append(recipe)
+        if not recipes:
+            print("No recipes found from vendor files")
+            logging.info("No recipes found from vendor files")
+            return
+    elif args.identifiers:
+        # Accept all recipe types passed via identifiers
+        recipes = list(args.identifiers)
+        if not recipes:
+            print("No recipes to override")
+            logging.info("No recipes to override")
+            return
+    else:
+        if not RECIPE_REPOS.exists():
+            sys.exit(f"Error: {RECIPE_REPOS} not found")
+        recipes = find_munki_recipes()
+        if not recipes:
+            sys.exit("No munki recipes found")
+
+    create_overrides(recipes, args.dry_run, args.force)
     logging.info(f"Log file: {log_file}")
 
 
@@ -0,0 +1,107 @@
+"""Process-wide GitHub rate-limit tracker fed by API response headers."""
+
+import threading
+import time
+from typing import Any
+
+try:
+    from github import Github
+except ImportError:
+    Github = None
+
+DEFAULT_MAX_AGE = 60.0
+
+
+class RateLimitTracker:
+    """Shared view of the GitHub core rate limit.
+
+    Every API consumer in the process reports what it learned from the
+    X-RateLimit-* headers of its own responses (update_from_headers /
+    update_from_client), which costs nothing. /rate_limit is only queried
+    when that data is older than max_age or has been invalidated, e.g. after
+    a subprocess such as `autopkg run` spent calls we could not observe.
+    """
+
+    def __init__(self, token: str | None = None, max_age: float = DEFAULT_MAX_AGE):
+        self.token = token
+        self.max_age = max_age
+        self._gh = None
+        self._info: dict[str, Any] | None = None
+        self._updated = float('-inf')
+        self._lock = threading.Lock()
+        self._fetch_lock = threading.Lock()  # coalesces concurrent refreshes into one request
+
+    def _set(self, limit: int, remaining: int, reset: int, used: int | None = None) -> None:
+        with self._lock:
+            self._info = {
+                'limit': limit,
+                'remaining': remaining,
+                'used': used if used is not None else limit - remaining,
+                'reset': reset,
+                'authenticated': bool(self.token),
+            }
+            self._updated = time.monotonic()
+
+    def update_from_headers(self, headers) -> None:
+        """Record the X-RateLimit-* values of any GitHub API response."""
+        h = {k.lower(): v for k, v in headers.items()}
+        if 'x-ratelimit-remaining' not in h or h.get('x-ratelimit-resource', 'core') != 'core':
+            return
+        try:
+            self._set(int(h['x-ratelimit-limit']), int(h['x-ratelimit-remaining']),
+                      int(h.get('x-ratelimit-reset', 0)),
+                      int(h['x-ratelimit-used']) if 'x-ratelimit-used' in h else None)
+        except (KeyError, ValueError):
+            return
+
+    def update_from_client(self, gh) -> None:
+        """Record the values PyGithub parsed from its last response (no request)."""
+        # Github.requester is public from PyGithub 2.1; older releases only have the mangled name
+        requester = getattr(gh, 'requester', None) or getattr(gh, '_Github__requester', None)
+        remaining, limit = getattr(requester, 'rate_limiting', (-1, -1))
+        if limit < 0:
+            return
+        self._set(limit, remaining, int(getattr(requester, 'rate_limiting_resettime', 0)))
+
+    def invalidate(self) -> None:
+        """Mark the data stale so the next status() call refreshes it."""
+        with self._lock:
+            self._updated = float('-inf')
+
+    def is_stale(self, max_age: float | None = None) -> bool:
+        age = self.max_age if max_age is None else max_age
+        return self._info is None or time.monotonic() - self._updated > age
+
+    def status(self, max_age: float | None = None) -> dict[str, Any]:
+        """Current rate limit, querying /rate_limit only if the cached data is stale."""
+        if not self.is_stale(max_age):
+            return dict(self._info)
+        if not Github:
+            return {'error': 'pygithub not installed', 'authenticated': bool(self.token)}
+        with self._fetch_lock:
+            if not self.is_stale(max_age):
+                return dict(self._info)
+            try:
+                if self._gh is None:
+                    self._gh = Github(login_or_token=self.token) if self.token else Github()
+                rate = self._gh.get_rate_limit().resources.core
+                self._set(rate.limit, rate.remaining, int(rate.reset.timestamp()))
+            except Exception as e:
+                return {'error': str(e), 'authenticated': bool(self.token)}
+        return dict(self._info)
+
+
+_tracker: RateLimitTracker | None = None
+_tracker_lock = threading.Lock()
+
+
+def get_tracker(token: str | None = None) -> RateLimitTracker:
+    """Return the process-wide tracker, creating it on first use."""
+    global _tracker
+    with _tracker_lock:
+        if _tracker is None:
+            _tracker = RateLimitTracker(token)
+        elif token and not _tracker.token:
+            _tracker.token = token
+            _tracker._gh = None
+        return _tracker
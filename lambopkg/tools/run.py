@@ -8,7 +8,9 @@ import os
 import plistlib
 import subprocess
 import sys
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 from typing import Any
@@ -18,15 +20,17 @@ try:
 except ImportError:
     yaml = None
 
-try:
-    from github import Github
-except ImportError:
-    Github = None
-
 PROJECT_ROOT = Path(__file__).resolve().parent.parent.parent
 LOG_DIR = PROJECT_ROOT / 'logs'
 RECIPE_REPOS = PROJECT_ROOT / 'AutoPkg/Recipes'
 
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from lambopkg.tools.rate_limit import get_tracker  # noqa: E402
+
+_print_lock = threading.Lock()
+
 
 def setup_logging():
     """Configure logging to file only (print statements handle console)."""
@@ -48,9 +52,10 @@ def setup_logging():
 
 
 def log_print(msg: str, level: str = 'info'):
-    """Print to console and log to file."""
-    print(msg)
-    getattr(logging, level)(msg)
+    """Print to console and log to file. Safe to call from worker threads."""
+    with _print_lock:
+        print(msg)
+        getattr(logging, level)(msg)
 
 
 def get_github_token() -> str | None:
@@ -65,21 +70,9 @@ def get_github_token() -> str | None:
 
 
 def check_github_rate_limit(token: str | None = None) -> dict[str, Any]:
-    """Check GitHub API rate limit status using PyGithub."""
-    if not Github:
-        return {'error': 'pygithub not installed', 'authenticated': bool(token)}
-    try:
-        gh = Github(login_or_token=token) if token else Github()
-        rate = gh.get_rate_limit().core
-        return {
-            'limit': rate.limit,
-            'remaining': rate.remaining,
-            'used': rate.limit - rate.remaining,
-            'reset': int(rate.reset.timestamp()),
-            'authenticated': bool(token),
-        }
-    except Exception as e:
-        return {'error': str(e), 'authenticated': bool(token)}
+    """Check GitHub API rate limit status via the shared tracker.
+    Only hits /rate_limit when the tracker's data is stale."""
+    return get_tracker(token).status()
 
 
 def print_rate_limit_status(info: dict[str, Any], label: str = "") -> None:
@@ -98,29 +91,45 @@ def print_rate_limit_status(info: dict[str, Any], label: str = "") -> None:
         logging.warning(msg)
 
 
-def run_recipes(recipes: list[str], dry_run: bool = False, fail_fast: bool = False,
-                github_token: str | None = None) -> tuple[int, int]:
-    """Run vendor recipes."""
-    if not recipes:
-        print("\nNo recipes found!")
-        logging.warning("No recipes found!")
-        return 0, 0
+def run_recipe_captured(recipe: str, cancel: threading.Event, github_token: str | None = None) -> tuple[str, bool | None]:
+    """Run one recipe, prefixing every output line with its name so concurrent
+    runs stay readable. Returns (name, success), with success None if cancelled."""
+    name = os.path.basename(recipe)
+    prefix = f"[{name.split('.')[0]}]"
+    if cancel.is_set():
+        return name, None
 
-    print(f"\nRunning {len(recipes)} recipes")
-    logging.info(f"Running {len(recipes)} recipes")
-    if dry_run:
-        for r in recipes:
-            print(f"  - {os.path.basename(r)}")
-            logging.info(f"  - {os.path.basename(r)}")
-        return len(recipes), 0
+    before = check_github_rate_limit(github_token)
+    if before.get('remaining', 1) == 0:
+        log_print(f"{prefix} ❌ RATE LIMITED", 'error')
+        return name, False
 
-    succeeded = failed = 0
+    log_print(f"{prefix} ▶️  Starting {name}")
+    try:
+        proc = subprocess.Popen(['autopkg', 'run', '-vvv', recipe], stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, text=True, bufsize=1)
+    except OSError as e:
+        log_print(f"{prefix} ❌ Failed to start: {e}", 'error')
+        return name, False
+    for line in proc.stdout:
+        log_print(f"{prefix} {line.rstrip()}")
+    proc.wait()
+    get_tracker().invalidate()  # autopkg spent calls this process can't see
+
+    if proc.returncode == 0:
+        log_print(f"{prefix} ✅ Success")
+        return name, True
+    log_print(f"{prefix} ❌ Failed ({proc.returncode})", 'error')
+    return name, False
+
+
+def run_recipes_serial(recipes: list[str], fail_fast: bool = False,
+                       github_token: str | None = None) -> tuple[int, list[str]]:
+    """Run recipes one at a time with output streamed straight to the console.
+    Returns (succeeded, failures)."""
+    succeeded = 0
     failures: list[str] = []
 
-    initial = check_github_rate_limit(github_token)
-    print_rate_limit_status(initial, "BEFORE:")
-    start_used = initial.get('used', 0)
-
     for i, recipe in enumerate(recipes, 1):
         name = os.path.basename(recipe)
         print(f"\n[{i}/{len(recipes)}] {name}")
@@ -130,14 +139,16 @@ def run_recipes(recipes: list[str], dry_run: bool = False, fail_fast: bool = Fal
         if before.get('remaining', 1) == 0:
             print("  ❌ RATE LIMITED")
             logging.error("RATE LIMITED")
-            failed += 1
             failures.append(name)
             if fail_fast:
                 break
             continue
 
         try:
-            subprocess.run(['autopkg', 'run', '-vvv', recipe], check=True)
+            try:
+                subprocess.run(['autopkg', 'run', '-vvv', recipe], check=True)
+            finally:
+                get_tracker().invalidate()  # autopkg spent calls this process can't see
             print("  ✅ Success")
             logging.info(f"Success: {name}")
             succeeded += 1
@@ -149,12 +160,75 @@ def run_recipes(recipes: list[str], dry_run: bool = False, fail_fast: bool = Fal
         except subprocess.CalledProcessError as e:
             print(f"  ❌ Failed ({e.returncode})")
             logging.error(f"Failed: {name} ({e.returncode})")
-            failed += 1
             failures.append(name)
             if fail_fast:
                 break
 
+    return succeeded, failures
+
+
+def run_recipes_parallel(recipes: list[str], jobs: int, fail_fast: bool = False,
+                         github_token: str | None = None) -> tuple[int, list[str], int]:
+    """Run recipes in a pool of at most `jobs` workers.
+    Returns (succeeded, failures, cancelled). Fail-fast cancels everything not yet started."""
+    cancel = threading.Event()
+    succeeded, failures, cancelled = 0, [], 0
+    log_print(f"Using up to {jobs} parallel jobs")
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(run_recipe_captured, r, cancel, github_token) for r in recipes]
+        for future in as_completed(futures):
+            if future.cancelled():
+                cancelled += 1
+                continue
+            name, ok = future.result()
+            if ok is None:
+                cancelled += 1
+                continue
+            if ok:
+                succeeded += 1
+            else:
+                failures.append(name)
+                if fail_fast and not cancel.is_set():
+                    log_print("  ⏹️  Fail-fast: cancelling pending recipes", 'warning')
+                    cancel.set()
+                    for f in futures:
+                        f.cancel()
+            log_print(f"[{succeeded + len(failures)}/{len(recipes)}] {'✅' if ok else '❌'} {name}")
+
+    return succeeded, failures, cancelled
+
+
+def run_recipes(recipes: list[str], dry_run: bool = False, fail_fast: bool = False,
+                github_token: str | None = None, jobs: int = 1) -> tuple[int, int]:
+    """Run vendor recipes."""
+    if not recipes:
+        print("\nNo recipes found!")
+        logging.warning("No recipes found!")
+        return 0, 0
+
+    print(f"\nRunning {len(recipes)} recipes")
+    logging.info(f"Running {len(recipes)} recipes")
+    if dry_run:
+        for r in recipes:
+            print(f"  - {os.path.basename(r)}")
+            logging.info(f"  - {os.path.basename(r)}")
+        return len(recipes), 0
+
+    cancelled = 0
+    initial = check_github_rate_limit(github_token)
+    print_rate_limit_status(initial, "BEFORE:")
+    start_used = initial.get('used', 0)
+
+    if jobs > 1:
+        succeeded, failures, cancelled = run_recipes_parallel(recipes, jobs, fail_fast, github_token)
+    else:
+        succeeded, failures = run_recipes_serial(recipes, fail_fast, github_token)
+    failed = len(failures)
+
     msg = f"\n{'=' * 40}\nTotal: {len(recipes)} | ✅ {succeeded} | ❌ {failed}"
+    if cancelled:
+        msg += f" | ⏹️  {cancelled} cancelled"
     print(msg)
     logging.info(msg)
     if failures:
@@ -177,6 +251,7 @@ def main() -> None:
     p.add_argument('--fail-fast', action='store_true')
     p.add_argument('--recipe', help='Run specific recipe')
     p.add_argument('--filenames', help='Comma-separated vendor recipe filenames')
+    p.add_argument('--jobs', '-j', type=int, default=1, help='Number of recipes to run concurrently')
     args = p.parse_args()
 
     log_file = setup_logging()
@@ -201,7 +276,7 @@ def main() -> None:
     recipe_repos = PROJECT_ROOT / 'AutoPkg/Recipes'
     os.chdir(recipe_repos)
     try:
-        _, failed = run_recipes(recipes, args.dry_run, args.fail_fast, get_github_token())
+        _, failed = run_recipes(recipes, args.dry_run, args.fail_fast, get_github_token(), max(1, args.jobs))
     finally:
         os.chdir(original_dir)
     logging.info(f"Log file: {log_file}")
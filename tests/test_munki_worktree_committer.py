@@ -0,0 +1,88 @@
+import importlib
+import subprocess
+from pathlib import Path
+
+import pytest
+
+autopkglib = pytest.importorskip("autopkglib")
+
+POSTPROCESSORS = Path(__file__).resolve().parent.parent / "AutoPkg" / "Recipes" / "PostProcessors"
+
+
+def git(*args, cwd):
+    return subprocess.run(["git", *args], cwd=cwd, check=True, capture_output=True, text=True).stdout.strip()  # noqa: S603
+
+
+@pytest.fixture
+def committer(monkeypatch):
+    monkeypatch.syspath_prepend(str(POSTPROCESSORS))
+    module = importlib.import_module("MunkiWorktreeCommitter")
+    processor = module.MunkiWorktreeCommitter()
+    processor.env = {"temp_index_commit": True, "remote": "origin", "branch": "main"}
+    return processor
+
+
+@pytest.fixture
+def worktree(tmp_path, monkeypatch):
+    """A worktree of a clone of a bare origin whose .gitignore keeps packages and Finder junk out."""
+    for var in ("GIT_AUTHOR", "GIT_COMMITTER"):
+        monkeypatch.setenv(f"{var}_NAME", "AutoPkg")
+        monkeypatch.setenv(f"{var}_EMAIL", "autopkg@example.com")
+    git("init", "--quiet", "--bare", "--initial-branch=main", "origin.git", cwd=tmp_path)
+    git("clone", "--quiet", "origin.git", "repo", cwd=tmp_path)
+    repo = tmp_path / "repo"
+    (repo / "pkgsinfo" / "apps").mkdir(parents=True)
+    (repo / "pkgsinfo" / "apps" / "a.plist").write_text("a")
+    (repo / "pkgsinfo" / "apps" / "b.plist").write_text("b")
+    (repo / ".gitignore").write_text("pkgs/\n.DS_Store\n")
+    git("add", "--all", cwd=repo)
+    git("commit", "--quiet", "--message", "init", cwd=repo)
+    git("push", "--quiet", "origin", "main", cwd=repo)
+    git("worktree", "add", "--quiet", "-b", "autopkg/test", str(tmp_path / "wt"), "origin/main", cwd=repo)
+    return tmp_path / "wt"
+
+
+def test_temp_index_commit_stages_changes_under_a_directory(committer, worktree):
+    (worktree / "pkgsinfo" / "apps" / "a.plist").write_text("a2")
+    (worktree / "pkgsinfo" / "apps" / "b.plist").unlink()
+    (worktree / "pkgsinfo" / "apps" / "c.plist").write_text("c")
+    (worktree / "pkgsinfo" / "apps" / ".DS_Store").write_text("junk")
+    (worktree / "pkgs").mkdir()
+    (worktree / "pkgs" / "c.pkg").write_text("installer")
+
+    sha = committer._commit_with_temp_index(worktree, [worktree / "pkgsinfo"], "Import c")
+
+    assert git("ls-tree", "-r", "--name-only", sha, cwd=worktree).split() == [
+        ".gitignore",
+        "pkgsinfo/apps/a.plist",
+        "pkgsinfo/apps/c.plist",
+    ]
+    assert git("show", f"{sha}:pkgsinfo/apps/a.plist", cwd=worktree) == "a2"
+
+
+def test_temp_index_commit_refuses_an_ignored_path(committer, worktree):
+    (worktree / "pkgs").mkdir()
+    (worktree / "pkgs" / "c.pkg").write_text("installer")
+
+    with pytest.raises(autopkglib.ProcessorError, match="ignored"):
+        committer._commit_with_temp_index(worktree, [worktree / "pkgs" / "c.pkg"], "Import c")
+
+
+def test_temp_index_commit_keeps_upstream_changes(committer, worktree, tmp_path):
+    upstream = tmp_path / "upstream"
+    git("clone", "--quiet", "origin.git", str(upstream), cwd=tmp_path)
+    (upstream / "pkgsinfo" / "apps" / "b.plist").unlink()
+    (upstream / "pkgsinfo" / "apps" / "d.plist").write_text("d")
+    git("add", "--all", cwd=upstream)
+    git("commit", "--quiet", "--message", "upstream", cwd=upstream)
+    git("push", "--quiet", "origin", "main", cwd=upstream)
+    (worktree / "pkgsinfo" / "apps" / "a.plist").write_text("a2")
+
+    sha = committer._commit_with_temp_index(worktree, [worktree / "pkgsinfo"], "Import a")
+
+    assert git("rev-parse", f"{sha}^", cwd=worktree) == git("rev-parse", "HEAD", cwd=upstream)
+    assert git("ls-tree", "-r", "--name-only", sha, cwd=worktree).split() == [
+        ".gitignore",
+        "pkgsinfo/apps/a.plist",
+        "pkgsinfo/apps/d.plist",
+    ]
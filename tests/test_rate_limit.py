@@ -0,0 +1,43 @@
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from lambopkg.tools import rate_limit
+
+
+class FakeGithub:
+    """Stands in for PyGithub 2.x, whose RateLimitOverview nests the core limit under resources."""
+
+    calls = 0
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def get_rate_limit(self):
+        FakeGithub.calls += 1
+        core = SimpleNamespace(limit=5000, remaining=4999, reset=datetime(2030, 1, 1, tzinfo=timezone.utc))
+        return SimpleNamespace(resources=SimpleNamespace(core=core), rate=core)
+
+
+def test_status_is_cached_within_max_age(monkeypatch):
+    monkeypatch.setattr(rate_limit, "Github", FakeGithub)
+    FakeGithub.calls = 0
+    tracker = rate_limit.RateLimitTracker(max_age=60)
+
+    first = tracker.status()
+    second = tracker.status()
+
+    assert first == second
+    assert first["remaining"] == 4999 and "error" not in first
+    assert FakeGithub.calls == 1
+
+
+def test_status_refreshes_after_invalidate(monkeypatch):
+    monkeypatch.setattr(rate_limit, "Github", FakeGithub)
+    FakeGithub.calls = 0
+    tracker = rate_limit.RateLimitTracker(max_age=60)
+
+    tracker.status()
+    tracker.invalidate()
+    tracker.status()
+
+    assert FakeGithub.calls == 2